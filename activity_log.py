@@ -0,0 +1,173 @@
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import queue
+import shutil
+import logging
+import argparse
+import threading
+from datetime import datetime
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+class ActivityLog:
+    """Background JSON Lines writer for user activity.
+
+    ``record`` only enqueues; a writer thread appends batches of records when
+    ``batch_size`` are waiting or every ``flush_interval`` seconds. The active
+    file is rotated once it exceeds ``max_bytes`` or ``max_age`` seconds; rotated
+    files are gzipped and named after the time range they cover
+    (``bot_log.<first>-<last>.jsonl.gz``) so queries can skip them by name.
+    """
+
+    def __init__(self, path="bot_log.jsonl", max_bytes=10 * 1024 * 1024, max_age=24 * 3600,
+                 backups=30, batch_size=200, flush_interval=2.0, queue_size=10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._first_ts = None
+        self._last_ts = None
+        self._thread = threading.Thread(target=self._run, name="activity-log", daemon=True)
+        self._thread.start()
+
+    def record(self, user_id, chat_id, content_type, content):
+        """Queue one activity record; never blocks the caller"""
+        entry = {"ts": round(time.time(), 3), "user_id": user_id, "chat_id": chat_id,
+                 "type": content_type, "content": content}
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Flush everything queued so far and stop the writer thread"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def queued(self):
+        """Records waiting for the writer thread"""
+        return self._queue.qsize()
+
+    def _open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._first_ts = self._last_ts = None
+        if self._file.tell():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._first_ts = json.loads(f.readline())["ts"]
+            except (ValueError, KeyError):
+                self._first_ts = time.time()
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        running = True
+        while running:
+            try:
+                entry = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                if entry is None:
+                    running = False
+                else:
+                    batch.append(entry)
+            except queue.Empty:
+                pass
+            if batch and (not running or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+        if self._file:
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    @registry.timed("storage_seconds", op="activity_log_write")
+    def _write(self, batch):
+        try:
+            if self._file is None:
+                self._open()
+            self._file.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in batch))
+            self._file.flush()
+            if self._first_ts is None:
+                self._first_ts = batch[0]["ts"]
+            self._last_ts = batch[-1]["ts"]
+            if self._file.tell() >= self.max_bytes or time.time() - self._first_ts >= self.max_age:
+                self._rotate()
+        except OSError as e:
+            logger.error(f"Failed to write activity log: {e}")
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        base, ext = os.path.splitext(self.path)
+        first, last = int(self._first_ts), int(self._last_ts or self._first_ts)
+        # Several rotations within one second: widen the range rather than overwrite
+        while os.path.exists(f"{base}.{first}-{last}{ext}.gz"):
+            last += 1
+        rotated = f"{base}.{first}-{last}{ext}"
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        for old in rotated_files(self.path)[:-self.backups]:
+            os.remove(old)
+
+def rotated_files(path):
+    """Rotated log files for ``path``, oldest first"""
+    base, ext = os.path.splitext(path)
+    return sorted(glob.glob(f"{glob.escape(base)}.*-*{ext}.gz"), key=file_time_range)
+
+def file_time_range(filepath):
+    """(first, last) timestamps encoded in a rotated file name"""
+    stamp = os.path.basename(filepath).split(".")[-3]
+    first, last = stamp.split("-")
+    return int(first), int(last)
+
+def query(path, user_id=None, since=None, until=None):
+    """Yield log records for a user and/or time range, skipping files outside the range"""
+    files = [(f, file_time_range(f)) for f in rotated_files(path)]
+    if os.path.exists(path):
+        files.append((path, (0, float("inf"))))
+    needle = f'"user_id": {user_id},' if user_id is not None else None
+    for filepath, (first, last) in files:
+        if (since is not None and last + 1 < since) or (until is not None and first > until):
+            continue
+        opener = gzip.open if filepath.endswith(".gz") else open
+        with opener(filepath, "rt", encoding="utf-8") as f:
+            for line in f:
+                if needle and needle not in line:
+                    continue
+                entry = json.loads(line)
+                if since is not None and entry["ts"] < since:
+                    continue
+                if until is not None and entry["ts"] > until:
+                    continue
+                yield entry
+
+def parse_time(value):
+    return datetime.fromisoformat(value).timestamp()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search the activity log and its rotated files")
+    parser.add_argument("--log", default="bot_log.jsonl")
+    parser.add_argument("--user", type=int, help="only records for this user id")
+    parser.add_argument("--since", type=parse_time, help="ISO date/time, e.g. 2024-05-01 or 2024-05-01T18:00")
+    parser.add_argument("--until", type=parse_time, help="ISO date/time")
+    args = parser.parse_args(argv)
+
+    for entry in query(args.log, args.user, args.since, args.until):
+        when = datetime.fromtimestamp(entry["ts"]).isoformat(sep=" ", timespec="seconds")
+        print(f"{when}  {entry['user_id']}  {entry['type']}  {entry['content']}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class MediaGroupBuffer:
+    """Collects the updates of a media group (album) and hands them over as one batch.
+
+    Telegram delivers each album item as a separate update sharing a
+    ``media_group_id``. Items are held until ``window`` seconds pass without a
+    new one, then ``flush(messages)`` is called once with the items in order.
+    """
+
+    def __init__(self, flush, window=1.0):
+        self.flush = flush
+        self.window = window
+        self._groups = {}
+        self._flushing = 0
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="media-groups", daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        """Albums buffered or being handled"""
+        return len(self._groups) + self._flushing
+
+    def add(self, message):
+        """Buffer an album item; returns False (and does nothing) for non-album messages"""
+        group_id = message.media_group_id
+        if not group_id:
+            return False
+        with self._cond:
+            deadline = time.monotonic() + self.window
+            if group_id in self._groups:
+                self._groups[group_id][1].append(message)
+                self._groups[group_id][0] = deadline
+            else:
+                self._groups[group_id] = [deadline, [message]]
+            self._cond.notify()
+        return True
+
+    def drain(self, timeout):
+        """Hand over every buffered album now instead of after its window; returns
+        False if they are not all handled within ``timeout`` seconds"""
+        with self._cond:
+            for group in self._groups.values():
+                group[0] = 0
+            self._cond.notify()
+        deadline = time.monotonic() + timeout
+        while len(self):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._groups:
+                    self._cond.wait()
+                now = time.monotonic()
+                due = [g for g, (deadline, _) in self._groups.items() if deadline <= now]
+                if not due:
+                    self._cond.wait(min(d for d, _ in self._groups.values()) - now)
+                    continue
+                batches = [self._groups.pop(g)[1] for g in due]
+                self._flushing = len(batches)
+            for messages in batches:
+                messages.sort(key=lambda m: m.message_id)
+                try:
+                    self.flush(messages)
+                except Exception as e:
+                    logger.error(f"Failed to handle album {messages[0].media_group_id}: {e}")
+                self._flushing -= 1
@@ -0,0 +1,276 @@
+import os
+import signal
+import asyncio
+import logging
+
+from telebot import apihelper, asyncio_helper, util
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.asyncio_handler_backends import BaseMiddleware, CancelUpdate
+
+import config
+import dispatch
+import lifecycle
+import metrics
+import segments
+from flood import PASS
+
+logger = logging.getLogger(__name__)
+
+# All API calls share one aiohttp session; this caps its keep-alive pool
+CONNECTION_LIMIT = int(os.getenv("ASYNC_CONNECTION_LIMIT", "100"))
+
+def read_file(filepath):
+    with open(filepath, "rb") as f:
+        return f.read()
+
+class AsyncMetricsMiddleware(BaseMiddleware):
+    """Async counterpart of metrics.MetricsMiddleware"""
+
+    def __init__(self):
+        self.update_types = ["message"]
+
+    async def pre_process(self, message, data):
+        metrics.registry.inc("updates_total", content_type=message.content_type)
+
+    async def post_process(self, message, data, exception):
+        pass
+
+class AsyncBlocklistMiddleware(BaseMiddleware):
+    """Async counterpart of blocklist.BlocklistMiddleware; answers banned users itself"""
+
+    def __init__(self, bot, blocklist):
+        self.update_types = ["message"]
+        self.bot = bot
+        self.blocklist = blocklist
+
+    async def pre_process(self, message, data):
+        if not self.blocklist.is_blocked(message.from_user.id):
+            return None
+        await self.bot.send_message(message.chat.id, config.banned)
+        return CancelUpdate()
+
+    async def post_process(self, message, data, exception):
+        pass
+
+class AsyncFloodMiddleware(BaseMiddleware):
+    """Async counterpart of flood.FloodMiddleware, sharing the same FloodGuard"""
+
+    def __init__(self, guard, exempt_ids=()):
+        self.update_types = ["message"]
+        self.guard = guard
+        self.exempt_ids = set(exempt_ids)
+
+    async def pre_process(self, message, data):
+        if message.from_user.id in self.exempt_ids:
+            return None
+        sample = (message.text or message.caption or f"[{message.content_type}]")[:100]
+        if self.guard.check(message.from_user.id, message.chat.id, message.media_group_id, sample) != PASS:
+            return CancelUpdate()
+        return None
+
+    async def post_process(self, message, data, exception):
+        pass
+
+def create_bot(core):
+    """Build an AsyncTeleBot with the same handlers as main.py.
+
+    ``core`` is the main module: state, texts and helpers are shared with the
+    synchronous bot. Storage and file I/O run in worker threads so a slow write
+    never blocks the event loop.
+    """
+    asyncio_helper.REQUEST_LIMIT = CONNECTION_LIMIT
+    if apihelper.API_URL:
+        asyncio_helper.API_URL = apihelper.API_URL
+    metrics.instrument_async_api()
+    bot = AsyncTeleBot(core.BOT_TOKEN, parse_mode="Markdown")
+    bot.setup_middleware(AsyncMetricsMiddleware())
+    bot.setup_middleware(AsyncFloodMiddleware(core.flood, exempt_ids=[core.ADMIN_ID]))
+    bot.setup_middleware(AsyncBlocklistMiddleware(bot, core.blocklist))
+
+    async def send_cached_photo(chat_id, filepath, **kwargs):
+        """Async counterpart of MediaCache.send_photo"""
+        file_id = await asyncio.to_thread(core.media.lookup, filepath)
+        if file_id:
+            try:
+                return await bot.send_photo(chat_id, file_id, **kwargs)
+            except ApiTelegramException as e:
+                if e.error_code != 400:
+                    raise
+                logger.warning(f"Cached file_id for {filepath} was rejected, re-uploading: {e}")
+                await asyncio.to_thread(core.media.invalidate, filepath)
+        photo = await asyncio.to_thread(read_file, filepath)
+        sent = await bot.send_photo(chat_id, photo, **kwargs)
+        await asyncio.to_thread(core.media.store, filepath, sent.photo[-1].file_id)
+        return sent
+
+    # Same plugin routes as the threaded bot; plugins reply through core.bot
+    dispatch.register_async(bot, core.bot)
+
+    @bot.message_handler(commands=['broadcast'])
+    async def broadcast_message(message):
+        """Handle broadcast command - Admin only"""
+        if message.from_user.id != core.ADMIN_ID:
+            await bot.reply_to(message, "❌ You are not authorized to use this command.")
+            return
+
+        try:
+            text = message.text.split(" ", 1)[1]
+        except IndexError:
+            text = ""
+
+        segment, text = segments.split_target(text)
+        if not text:
+            await bot.reply_to(message, "❌ Please provide a message to broadcast.\n\n*Usage:* `/broadcast [to:segment] Your message here`")
+            return
+        try:
+            segments.parse(segment)
+        except ValueError as e:
+            await bot.reply_to(message, f"❌ {e}\nFilters: {segments.describe()}", parse_mode=None)
+            return
+
+        # The broadcaster has its own worker threads; starting it only sends the progress message
+        payload = {"type": "text", "text": f"📢 *Broadcast Message:*\n\n{text}"}
+        started = await asyncio.to_thread(core.broadcaster.start, message.chat.id, payload, segment)
+        if not started:
+            await bot.reply_to(message, "⏳ A broadcast is already running. Please wait for it to finish.")
+
+    @bot.message_handler(commands=['segment'])
+    async def count_segment(message):
+        """Count a broadcast segment - Admin only; answered through core.bot"""
+        await asyncio.to_thread(core.count_segment, message)
+
+    @bot.message_handler(commands=['stats'])
+    async def show_stats(message):
+        """Show bot statistics - Admin only"""
+        if message.from_user.id != core.ADMIN_ID:
+            return
+        text = await asyncio.to_thread(core.build_stats_text)
+        await bot.reply_to(message, text)
+
+    @bot.message_handler(commands=['metrics'])
+    async def show_metrics(message):
+        """Dump latency histograms and counters - Admin only"""
+        if message.from_user.id != core.ADMIN_ID:
+            return
+        for chunk in util.smart_split(metrics.registry.summary(), 4000):
+            await bot.send_message(message.chat.id, chunk, parse_mode=None)
+
+    @bot.message_handler(commands=['outbox'])
+    async def show_dead_letters(message):
+        """List the most recent dead letters - Admin only"""
+        if message.from_user.id != core.ADMIN_ID:
+            return
+        text = await asyncio.to_thread(core.build_dead_letters_text)
+        for chunk in util.smart_split(text, 4000):
+            await bot.send_message(message.chat.id, chunk, parse_mode=None)
+
+    @bot.message_handler(commands=['replay'])
+    async def replay_dead_letters(message):
+        """Queue dead letters again - Admin only"""
+        if message.from_user.id != core.ADMIN_ID:
+            return
+        arg = util.extract_arguments(message.text).strip()
+        if arg != "all" and not arg.isdigit():
+            await bot.reply_to(message, "*Usage:* `/replay <id>` or `/replay all`")
+            return
+        count = await asyncio.to_thread(core.outbox.replay, None if arg == "all" else int(arg))
+        await bot.reply_to(message, f"🔁 Re-queued {count} messages.")
+
+    @bot.message_handler(commands=['many'])
+    async def start_reply_to_many(message):
+        """Link a prompt to several users - Admin only; answered through core.bot"""
+        await asyncio.to_thread(core.start_reply_to_many, message)
+
+    @bot.message_handler(func=core.match_trigger, content_types=util.content_type_media)
+    async def handle_trigger(message):
+        """Run the action of the trigger rule a message matched"""
+        rule = core.match_trigger(message)
+        if rule is None:
+            await handle_all_messages(message)
+        elif rule.action == "offer":
+            await send_vip_offer(message)
+        elif rule.action == "reply":
+            await bot.reply_to(message, rule.reply)
+        elif rule.action == "forward":
+            await handle_all_messages(message)
+            await asyncio.to_thread(core.outbox.send, "send_message", core.ADMIN_ID,
+                                    f"🔔 Trigger '{rule.name}' matched from user {message.from_user.id}", parse_mode=None)
+
+    async def send_vip_offer(message):
+        """Send VIP offer when triggered by keywords"""
+        user_id = message.from_user.id
+
+        if core.has_seen_vip(user_id):
+            await bot.reply_to(message, "You've already received our VIP offer! Check your previous messages. 😊")
+            return
+
+        await asyncio.to_thread(core.mark_seen_vip, user_id)
+
+        markup = core.VIP_MARKUP
+        caption = core.VIP_CAPTION
+        try:
+            if await asyncio.to_thread(core.media.exists, core.VIP_OFFER_IMAGE):
+                await send_cached_photo(message.chat.id, core.VIP_OFFER_IMAGE, caption=caption, reply_markup=markup)
+            else:
+                await bot.send_message(message.chat.id, caption, reply_markup=markup)
+        except Exception as e:
+            logger.error(f"Failed to send VIP offer: {e}")
+            await bot.send_message(message.chat.id, caption, reply_markup=markup)
+
+    @bot.message_handler(func=core.is_admin_reply, content_types=util.content_type_media)
+    async def handle_admin_reply(message):
+        """Handle admin replies to forwarded messages"""
+        # Albums are delivered by the shared media group buffer in main.py
+        if core.albums.add(message):
+            return
+
+        # Copied by the shared outbox, which also sends the confirmation
+        await asyncio.to_thread(core.relay_reply, [message], message.reply_to_message.message_id)
+
+    @bot.message_handler(func=lambda message: True, content_types=util.content_type_media)
+    async def handle_all_messages(message):
+        """Handle all other messages - track users and forward to admin"""
+        user_id = message.from_user.id
+
+        if core.albums.add(message):
+            return
+
+        await asyncio.to_thread(core.save_user, user_id)
+
+        if user_id == core.ADMIN_ID:
+            return
+
+        await asyncio.to_thread(core.outbox.send, "forward_message", core.ADMIN_ID, message.chat.id,
+                                message.message_id, callback="forward", context={"user_id": user_id})
+
+        # Writes last_seen to SQLite (and may checkpoint the WAL): off the loop
+        await asyncio.to_thread(core.log_user_activity, message)
+
+    metrics.instrument_handlers(bot)
+    return bot
+
+def run(core):
+    """Run the async bot until polling stops or SIGTERM/SIGINT arrives; handlers
+    already running get until the shutdown deadline to finish"""
+    bot = create_bot(core)
+
+    async def polling():
+        poller = asyncio.create_task(bot.infinity_polling(timeout=20))
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, poller.cancel)
+        try:
+            await poller
+        except asyncio.CancelledError:
+            pass
+        finally:
+            pending = asyncio.all_tasks() - {asyncio.current_task()}
+            if pending:
+                logger.info(f"Waiting for {len(pending)} handler tasks to finish")
+                _, unfinished = await asyncio.wait(pending, timeout=lifecycle.remaining())
+                if unfinished:
+                    logger.warning(f"Shutdown: {len(unfinished)} handler tasks did not finish")
+            await bot.close_session()
+
+    asyncio.run(polling())
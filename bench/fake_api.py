@@ -0,0 +1,229 @@
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import itertools
+import threading
+from collections import Counter, deque
+from email.parser import BytesParser
+from urllib.parse import parse_qsl, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import apihelper, asyncio_helper
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+# Methods answered with True rather than a message
+BOOLEAN_METHODS = {"deletewebhook", "setwebhook", "answercallbackquery", "deletemessage",
+                   "sendchataction", "setmycommands", "close", "logout"}
+
+def parse_form(content_type, body):
+    """Text fields of an urlencoded or multipart request body; uploaded files are skipped"""
+    if not body:
+        return {}
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return dict(parse_qsl(body.decode("utf-8")))
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        fields = {}
+        for part in message.get_payload():
+            if part.get_filename() is None:
+                fields[part.get_param("name", header="content-disposition")] = part.get_payload(decode=True).decode("utf-8")
+        return fields
+    return {}
+
+class FakeBotAPI:
+    """Local stand-in for the Telegram Bot API, for load tests that must not hit Telegram.
+
+    Implements getMe, getUpdates and the send/forward/copy/edit methods the bot
+    uses, answering with minimal but well-formed objects. Every call sleeps
+    ``latency`` seconds (plus up to ``jitter``), and a ``rate_limit`` fraction of
+    calls is answered with a 429 carrying ``retry_after``. Updates queued with
+    ``push_update`` are served to getUpdates. Forwards remember their source
+    chat in ``sources``; sent texts are kept in ``sent`` (and by message id in
+    ``sent_ids``) and copies as (chat_id, message_id) in ``copied``, for checking.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+                 rate_limit=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.forwarded = deque(maxlen=100000)
+        self.sources = {}
+        self.sent = deque(maxlen=100000)
+        self.sent_ids = {}
+        self.copied = deque(maxlen=100000)
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1)
+        self._updates = deque()
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="fake-api", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def install(self):
+        """Point TeleBot and AsyncTeleBot at this server instead of api.telegram.org"""
+        apihelper.API_URL = self.url + "/bot{0}/{1}"
+        asyncio_helper.API_URL = self.url + "/bot{0}/{1}"
+        return self
+
+    def push_update(self, update):
+        with self._lock:
+            self._updates.append(update)
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.throttled.clear()
+
+    def _message(self, chat_id, **fields):
+        message = {"message_id": next(self._message_ids), "date": int(time.time()),
+                   "chat": {"id": int(chat_id or 0), "type": "private"}, "from": BOT_USER}
+        message.update(fields)
+        return message
+
+    def _photo(self):
+        file_id = f"fake-photo-{next(self._message_ids)}"
+        return [{"file_id": file_id, "file_unique_id": file_id, "width": 90, "height": 90}]
+
+    def handle(self, method, params):
+        """Result for one API call, or raise LookupError for unknown methods"""
+        name = method.lower()
+        chat_id = params.get("chat_id")
+        if name == "getme":
+            return BOT_USER
+        if name == "getupdates":
+            deadline = time.monotonic() + min(float(params.get("timeout") or 0), 1.0)
+            limit = int(params.get("limit") or 100)
+            while True:
+                with self._lock:
+                    batch = [self._updates.popleft() for _ in range(min(limit, len(self._updates)))]
+                if batch or time.monotonic() >= deadline:
+                    return batch
+                time.sleep(0.01)
+        if name in BOOLEAN_METHODS:
+            return True
+        if name == "forwardmessage":
+            message = self._message(chat_id, text="[forwarded]")
+            self.forwarded.append(message["message_id"])
+            self.sources[message["message_id"]] = int(params.get("from_chat_id") or 0)
+            return message
+        if name in ("forwardmessages", "copymessages"):
+            ids = [{"message_id": next(self._message_ids)} for _ in json.loads(params.get("message_ids", "[]"))]
+            if name == "forwardmessages":
+                self.forwarded.extend(m["message_id"] for m in ids)
+            return ids
+        if name == "copymessage":
+            self.copied.append((int(chat_id or 0), int(params.get("message_id") or 0)))
+            return {"message_id": next(self._message_ids)}
+        if name == "sendmediagroup":
+            media = json.loads(params.get("media", "[]"))
+            return [self._message(chat_id, photo=self._photo()) for _ in media]
+        if name == "sendphoto":
+            return self._message(chat_id, photo=self._photo(), caption=params.get("caption"))
+        if name == "sendmessage":
+            message = self._message(chat_id, text=params.get("text", ""))
+            self.sent.append((int(chat_id or 0), message["text"]))
+            self.sent_ids[message["message_id"]] = message["text"]
+            return message
+        if name.startswith("send") or name.startswith("edit"):
+            return self._message(chat_id, text=params.get("text", ""))
+        raise LookupError(method)
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Headers and body go out as separate writes; without this, Nagle's
+            # algorithm and delayed ACKs add ~40ms to every call
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _dispatch(self):
+                parts = urlsplit(self.path)
+                method = parts.path.rsplit("/", 1)[-1]
+                params = dict(parse_qsl(parts.query))
+                length = int(self.headers.get("Content-Length") or 0)
+                params.update(parse_form(self.headers.get("Content-Type", ""), self.rfile.read(length)))
+
+                with api._lock:
+                    api.calls[method] += 1
+                    throttle = method != "getUpdates" and api._random.random() < api.rate_limit
+                    delay = api.latency + api._random.random() * api.jitter
+                if delay:
+                    time.sleep(delay)
+                if throttle:
+                    with api._lock:
+                        api.throttled[method] += 1
+                    self._reply(429, {"ok": False, "error_code": 429,
+                                      "description": f"Too Many Requests: retry after {api.retry_after}",
+                                      "parameters": {"retry_after": api.retry_after}})
+                    return
+                try:
+                    result = api.handle(method, params)
+                except LookupError:
+                    self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                    return
+                self._reply(200, {"ok": True, "result": result})
+
+            do_GET = _dispatch
+            do_POST = _dispatch
+
+        return Handler
+
+def main(argv=None):
+    """Run the fake Bot API standalone; point a bot at it with apihelper.API_URL"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.02, help="extra random seconds per call")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    api = FakeBotAPI(port=args.port, latency=args.latency, jitter=args.jitter,
+                     rate_limit=args.rate_limit, retry_after=args.retry_after).start()
+    print(f"Fake Bot API on {api.url} (set apihelper.API_URL = '{api.url}/bot{{0}}/{{1}}')")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.stop()
+        print(dict(api.calls))
+
+if __name__ == "__main__":
+    sys.exit(main())
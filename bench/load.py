@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from bench.fake_api import FakeBotAPI
+
+ADMIN_ID = 999000
+SCENARIOS = ("new_users", "triggers", "albums", "admin_replies", "broadcast")
+
+def rss_kb():
+    """Current resident set size in KiB (peak RSS where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+class Traffic:
+    """Synthetic Telegram updates, numbered so every update and message id is unique"""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def message(self, user_id, text=None, reply_to=None, **fields):
+        message_id = next(self._ids)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        }
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if reply_to is not None:
+            message["reply_to_message"] = {"message_id": reply_to, "date": int(time.time()),
+                                           "chat": {"id": user_id, "type": "private"}}
+        message.update(fields)
+        return {"update_id": message_id, "message": message}
+
+    def album(self, user_id, size=3):
+        group_id = f"album{next(self._ids)}"
+        return [self.message(user_id, media_group_id=group_id, caption="set" if i == 0 else None,
+                             photo=[{"file_id": f"p{user_id}-{i}", "file_unique_id": f"u{user_id}-{i}",
+                                     "width": 90, "height": 90}])
+                for i in range(size)]
+
+class LoadTest:
+    """Replays synthetic traffic through main.py's handlers against a FakeBotAPI"""
+
+    def __init__(self, core, api, concurrency=8):
+        self.core = core
+        self.api = api
+        self.concurrency = concurrency
+        self.traffic = Traffic()
+        self._user_ids = itertools.count(1000)
+        self.known_users = []
+
+    def _process(self, update):
+        from telebot import types
+        update = types.Update.de_json(update)
+        started = time.perf_counter()
+        self.core.bot.process_new_updates([update])
+        return time.perf_counter() - started
+
+    def replay(self, updates):
+        """Feed updates through the handlers on ``concurrency`` threads; returns latencies"""
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            return list(pool.map(self._process, updates))
+
+    def settle(self, timeout=10):
+        """Wait for album buffers, the outbox and the activity log writer to drain"""
+        deadline = time.monotonic() + timeout
+        time.sleep(self.core.albums.window + 0.2)
+        while time.monotonic() < deadline and (len(self.core.albums) or len(self.core.outbox)
+                                               or self.core.activity.queued()):
+            time.sleep(0.05)
+
+    def new_users(self, count):
+        updates = []
+        for _ in range(count):
+            user_id = next(self._user_ids)
+            self.known_users.append(user_id)
+            updates.append(self.traffic.message(user_id, "/start"))
+            updates.append(self.traffic.message(user_id, "hello, first message"))
+        return self.replay(updates)
+
+    def triggers(self, count):
+        users = self.known_users or [next(self._user_ids) for _ in range(count)]
+        updates = [self.traffic.message(users[i % len(users)], "magkano po VIP?") for i in range(count)]
+        return self.replay(updates)
+
+    def albums(self, count):
+        users = self.known_users or [next(self._user_ids) for _ in range(count)]
+        updates = [u for i in range(count) for u in self.traffic.album(users[i % len(users)])]
+        return self.replay(updates)
+
+    def admin_replies(self, count):
+        forwarded = list(self.api.forwarded)
+        if not forwarded:
+            self.new_users(count)
+            forwarded = list(self.api.forwarded)
+        updates = [self.traffic.message(ADMIN_ID, "thanks!", reply_to=forwarded[i % len(forwarded)])
+                   for i in range(count)]
+        return self.replay(updates)
+
+    def broadcast(self, count):
+        """Broadcast to ``count`` new users plus everyone already known; returns the
+        number of recipients (broadcasts run off the handlers, so there are no latencies)"""
+        for _ in range(count):
+            self.core.state.add_user(next(self._user_ids))
+        self.core.broadcaster.start(ADMIN_ID, {"type": "text", "text": "bench broadcast"})
+        while self.core.broadcaster.is_running():
+            time.sleep(0.05)
+        return self.core.state.user_count()
+
+def run_scenario(test, name, count):
+    test.api.reset_counters()
+    rss_before = rss_kb()
+    started = time.perf_counter()
+    latencies = getattr(test, name)(count)
+    if isinstance(latencies, int):
+        processed, latencies = latencies, []
+    else:
+        processed = len(latencies)
+    test.settle()
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": name,
+        "updates": processed,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(processed / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        "rss_growth_kb": rss_kb() - rss_before,
+        "api_calls": sum(test.api.calls.values()),
+        "api_429": sum(test.api.throttled.values()),
+    }
+
+def load_core(workdir, broadcast_rate):
+    """Import main.py with its state files in ``workdir`` and limits opened up for benchmarking"""
+    os.chdir(workdir)
+    os.environ.update({
+        "BOT_TOKEN": "123456:BENCH",
+        "ADMIN_ID": str(ADMIN_ID),
+        "METRICS_PORT": "0",
+        "FLOOD_BURST": "1000000",
+        "BROADCAST_RATE": str(broadcast_rate),
+    })
+    shutil.copy(os.path.join(REPO_ROOT, "triggers.json"), workdir)
+    import main
+    main.bot.threaded = False
+    main.outbox.start()
+    return main
+
+def main(argv=None):
+    """Offline load test: replay synthetic traffic through main.py against a fake Bot API"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--count", type=int, default=500, help="users / messages per scenario")
+    parser.add_argument("--broadcast-users", type=int, default=2000)
+    parser.add_argument("--broadcast-rate", type=int, default=1000, help="messages/second cap")
+    parser.add_argument("--concurrency", type=int, default=8, help="handler threads")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per scenario")
+    parser.add_argument("--keep", action="store_true", help="keep the state directory")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                     retry_after=1, seed=args.seed).start().install()
+    core = load_core(workdir, args.broadcast_rate)
+    logging.getLogger().setLevel(logging.WARNING)
+    test = LoadTest(core, api, concurrency=args.concurrency)
+
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    try:
+        for name in scenarios:
+            count = args.broadcast_users if name == "broadcast" else args.count
+            result = run_scenario(test, name, count)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                p50, p99 = (f"{result[k]:7.2f}ms" if result[k] is not None else "      -  "
+                            for k in ("p50_ms", "p99_ms"))
+                print(f"{name:14} {result['updates']:7d} in {result['seconds']:7.2f}s  "
+                      f"{result['updates_per_sec']:8.1f}/s  p50 {p50}  p99 {p99}  "
+                      f"rss +{result['rss_growth_kb']}KiB  "
+                      f"api {result['api_calls']} (429: {result['api_429']})")
+    finally:
+        core.shutdown()
+        api.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from bench.fake_api import FakeBotAPI
+from bench.load import Traffic
+
+ADMIN_ID = 999000
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+def run(shards, users, lanes, latency, timeout=60):
+    """Route ``users`` first messages and one admin reply to each through a
+    router and ``shards`` handler processes, then one ``/many`` prompt and a
+    reply to it; returns the figures as a dict"""
+    from telebot import TeleBot
+
+    import shard
+    from msg_index import MessageLinkIndex
+
+    api = FakeBotAPI(latency=latency).start().install()
+    os.environ.update({
+        "BOT_TOKEN": "123456:BENCH",
+        "ADMIN_ID": str(ADMIN_ID),
+        "BOT_API_URL": api.url,
+        "METRICS_PORT": "0",
+        "FLOOD_BURST": "1000000",
+        "OUTBOX_RATE": "100000",
+    })
+    traffic = Traffic()
+    links = MessageLinkIndex(shard.router_path("bot_state.db"))
+    router = shard.Router(ADMIN_ID, links, shards, lanes=lanes)
+    router.start()
+    bot = TeleBot("123456:BENCH")
+    threading.Thread(target=shard.poll, args=(bot, router, 1), name="ingress", daemon=True).start()
+    try:
+        # One message per shard, so every process has started before timing
+        for user_id in range(1, shards + 1):
+            api.push_update(traffic.message(user_id, "warm up"))
+        if not wait_for(lambda: len(api.forwarded) >= shards, timeout):
+            raise RuntimeError("shard processes did not start")
+        started = time.perf_counter()
+        for user_id in range(1000, 1000 + users):
+            api.push_update(traffic.message(user_id, f"hello from {user_id}"))
+        wait_for(lambda: len(api.forwarded) >= shards + users, timeout)
+        forward_seconds = time.perf_counter() - started
+
+        # Wait until the router knows every forward, then reply to each one
+        forwards = [m for m in list(api.forwarded) if api.sources.get(m, 0) >= 1000]
+        wait_for(lambda: all(links.get(m) for m in forwards), timeout)
+        started = time.perf_counter()
+        expected = {}
+        for message_id in forwards:
+            update = traffic.message(ADMIN_ID, "thanks!", reply_to=message_id)
+            expected[update["message"]["message_id"]] = api.sources[message_id]
+            api.push_update(update)
+        replies = lambda: [(chat, m) for chat, m in list(api.copied) if m in expected]
+        wait_for(lambda: len(replies()) >= len(forwards), timeout)
+        reply_seconds = time.perf_counter() - started
+        delivered = replies()
+        misrouted = sum(1 for chat, message_id in delivered if expected[message_id] != chat)
+        # Each delivery is confirmed to the admin by the shard that made it
+        confirmed = lambda: sum(1 for chat, text in list(api.sent) if chat == ADMIN_ID and text.startswith("✅"))
+        wait_for(lambda: confirmed() >= len(delivered), timeout)
+
+        # "/many" on a forward is handled by its sender's shard, which must also
+        # get the reply to the prompt; pick a sender away from the admin's shard
+        target = next((m for m in forwards if shard.shard_of(api.sources[m], shards) != shard.shard_of(ADMIN_ID, shards)),
+                      forwards[0])
+        api.push_update(traffic.message(ADMIN_ID, "/many", reply_to=target))
+        prompts = lambda: [m for m, text in list(api.sent_ids.items()) if text.startswith("👥")]
+        wait_for(lambda: prompts() and links.get(prompts()[0]), timeout)
+        many_reply = traffic.message(ADMIN_ID, "to many", reply_to=(prompts() or [0])[0])
+        api.push_update(many_reply)
+        many_delivered = wait_for(
+            lambda: (api.sources[target], many_reply["message"]["message_id"]) in list(api.copied), timeout)
+    finally:
+        router.stop()
+        links.close()
+        api.stop()
+    return {
+        "shards": shards,
+        "users": users,
+        "forwards": len(forwards),
+        "forwards_per_sec": round(len(forwards) / forward_seconds, 1) if forward_seconds else 0.0,
+        "replies": len(delivered),
+        "replies_per_sec": round(len(delivered) / reply_seconds, 1) if reply_seconds else 0.0,
+        "misrouted": misrouted,
+        "many_delivered": many_delivered,
+        "confirmed": confirmed(),
+        "routed": router.routed,
+    }
+
+def main(argv=None):
+    """Scale-out test: a router and N handler processes against a fake Bot API"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--lanes", type=int, default=4, help="handler threads per shard")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API seconds per call")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix="bot-shards-")
+    shutil.copy(os.path.join(REPO_ROOT, "triggers.json"), workdir)
+    os.chdir(workdir)
+    try:
+        result = run(args.shards, args.users, args.lanes, args.latency)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"{result['shards']} shards: {result['forwards']} forwards at {result['forwards_per_sec']}/s, "
+              f"{result['replies']} admin replies at {result['replies_per_sec']}/s, "
+              f"{result['misrouted']} misrouted, {result['confirmed']} confirmed, "
+              f"/many reply {'delivered' if result['many_delivered'] else 'LOST'}; per shard {result['routed']}")
+    failed = result["misrouted"] or result["replies"] < result["forwards"] or not result["many_delivered"]
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
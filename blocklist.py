@@ -0,0 +1,203 @@
+import sys
+import csv
+import time
+import logging
+import argparse
+import threading
+
+from telebot.handler_backends import BaseMiddleware, CancelUpdate
+
+import db
+
+logger = logging.getLogger(__name__)
+
+class TimerWheel:
+    """Hashed timer wheel: O(1) schedule/cancel, one slot inspected per tick.
+
+    Deadlines further away than one revolution are parked with a round
+    counter, so even bans lasting months cost nothing until they are due.
+    """
+
+    def __init__(self, callback, slots=3600, tick=1.0):
+        self.callback = callback
+        self.slots = [dict() for _ in range(slots)]
+        self.tick = tick
+        self._where = {}
+        self._position = int(time.time() // tick) % slots
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="timer-wheel", daemon=True)
+        self._thread.start()
+
+    def schedule(self, key, at):
+        """Call ``callback(key)`` at unix time ``at``, replacing any earlier schedule"""
+        ticks = max(1, int((at - time.time()) / self.tick + 0.5))
+        rounds = (ticks - 1) // len(self.slots)
+        with self._lock:
+            slot = (self._position + ticks) % len(self.slots)
+            self._cancel(key)
+            self.slots[slot][key] = rounds
+            self._where[key] = slot
+
+    def cancel(self, key):
+        with self._lock:
+            self._cancel(key)
+
+    def _cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            self.slots[slot].pop(key, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            with self._lock:
+                self._position = (self._position + 1) % len(self.slots)
+                bucket = self.slots[self._position]
+                due = [key for key, rounds in bucket.items() if rounds == 0]
+                for key in bucket:
+                    bucket[key] -= 1
+                for key in due:
+                    del bucket[key]
+                    del self._where[key]
+            for key in due:
+                try:
+                    self.callback(key)
+                except Exception as e:
+                    logger.error(f"Timer callback failed for {key}: {e}")
+
+class Blocklist:
+    """Banned user ids held in memory, written through to the ``blocked`` table.
+
+    ``is_blocked`` is a set lookup and never touches disk. Temporary bans are
+    lifted by a timer wheel when they expire, not by checks on each message.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocked = set()
+        self.wheel = TimerWheel(self._expire)
+        now = time.time()
+        expired = []
+        for user_id, until in db.all_blocked():
+            if until is not None and until <= now:
+                expired.append(user_id)
+                continue
+            self._blocked.add(user_id)
+            if until is not None:
+                self.wheel.schedule(user_id, until)
+        for user_id in expired:
+            db.unblock(user_id)
+        logger.info(f"Loaded {len(self._blocked)} blocked users")
+
+    def is_blocked(self, user_id):
+        return user_id in self._blocked
+
+    def __len__(self):
+        return len(self._blocked)
+
+    def block(self, user_id, duration=None):
+        """Ban a user, for ``duration`` seconds or permanently; returns True if newly banned"""
+        until = int(time.time() + duration) if duration else None
+        with self._lock:
+            new = db.block(user_id, until)
+            self._blocked.add(user_id)
+            if until is None:
+                self.wheel.cancel(user_id)
+            else:
+                self.wheel.schedule(user_id, until)
+        return new
+
+    def unblock(self, user_id):
+        with self._lock:
+            removed = db.unblock(user_id)
+            self._blocked.discard(user_id)
+            self.wheel.cancel(user_id)
+        return removed
+
+    def _expire(self, user_id):
+        self.unblock(user_id)
+        logger.info(f"Temporary ban expired for {user_id}")
+
+    def import_bans(self, bans):
+        """Bulk-add (user_id, until) pairs; ``until`` is a unix time or None"""
+        now = time.time()
+        bans = [(int(u), int(t) if t else None) for u, t in bans]
+        bans = [(u, t) for u, t in bans if t is None or t > now]
+        with self._lock:
+            db.block_many(bans)
+            for user_id, until in bans:
+                self._blocked.add(user_id)
+                if until is None:
+                    self.wheel.cancel(user_id)
+                else:
+                    self.wheel.schedule(user_id, until)
+        return len(bans)
+
+    def export_bans(self):
+        return db.all_blocked()
+
+class BlocklistMiddleware(BaseMiddleware):
+    """TeleBot middleware that stops messages from banned users before any handler;
+    ``on_blocked(message)`` may answer them"""
+
+    def __init__(self, blocklist, on_blocked=None):
+        self.update_types = ["message"]
+        self.blocklist = blocklist
+        self.on_blocked = on_blocked
+
+    def pre_process(self, message, data):
+        if not self.blocklist.is_blocked(message.from_user.id):
+            return None
+        if self.on_blocked:
+            self.on_blocked(message)
+        return CancelUpdate()
+
+    def post_process(self, message, data, exception):
+        pass
+
+def parse_duration(text):
+    """Seconds for '30m', '12h', '7d' or a bare number of seconds; None if not a duration"""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    text = (text or "").strip().lower()
+    if not text:
+        return None
+    factor = units.get(text[-1])
+    number = text[:-1] if factor else text
+    if not number.isdigit():
+        return None
+    return int(number) * (factor or 1)
+
+def read_bans_csv(f):
+    """(user_id, until) pairs from a CSV file with a "user_id,until" header"""
+    return [(row["user_id"], row.get("until")) for row in csv.DictReader(f)]
+
+def write_bans_csv(f, bans):
+    writer = csv.writer(f)
+    writer.writerow(["user_id", "until"])
+    writer.writerows(bans)
+
+blocklist = Blocklist()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Import or export bans as CSV (user_id,until). While the bot runs, use "
+                    "/exportbans and /importbans instead: a running bot does not see bans "
+                    "imported here until it restarts.")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("file")
+    parser.add_argument("--offline", action="store_true", help="confirm the bot is stopped (required for import)")
+    args = parser.parse_args(argv)
+
+    if args.action == "export":
+        with open(args.file, "w", newline="", encoding="utf-8") as f:
+            write_bans_csv(f, blocklist.export_bans())
+    else:
+        if not args.offline:
+            parser.error("import writes behind a running bot; stop it and pass --offline, "
+                         "or reply /importbans to the CSV file in the admin chat")
+        with open(args.file, "r", newline="", encoding="utf-8") as f:
+            rows = read_bans_csv(f)
+        print(f"imported {blocklist.import_bans(rows)} bans")
+
+if __name__ == "__main__":
+    sys.exit(main())
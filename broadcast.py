@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import queue
+import threading
+import logging
+
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+
+from storage import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows roughly 30 messages per second across all chats
+GLOBAL_RATE = 25
+WORKERS = 8
+MAX_ATTEMPTS = 5
+PROGRESS_INTERVAL = 5
+
+# API error descriptions that mean the user can never be reached again
+UNREACHABLE_ERRORS = (
+    "bot was blocked by the user",
+    "user is deactivated",
+    "chat not found",
+    "bot can't initiate conversation",
+)
+
+def retry_after(error):
+    """Seconds Telegram asked us to wait, from a 429 error"""
+    params = (error.result_json or {}).get("parameters") or {}
+    return params.get("retry_after", 1)
+
+def is_unreachable(error):
+    if error.error_code not in (400, 403):
+        return False
+    description = (error.description or "").lower()
+    return any(reason in description for reason in UNREACHABLE_ERRORS)
+
+class TokenBucket:
+    """Thread-safe token bucket; ``acquire`` blocks until a token is available"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Stop handing out tokens for ``seconds`` (used for 429 retry_after)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class Broadcaster:
+    """Runs one broadcast at a time on a rate-limited worker pool, off the update loop.
+
+    Recipients are streamed from ``audience`` (a segments.Segments) in
+    ascending user ID order, never held as a list. The checkpoint file records
+    the segment and the highest ID below which every recipient has been
+    handled, so after a crash ``resume`` continues from there (at most a few
+    in-flight messages may be sent twice). Users who blocked the bot are
+    passed to ``prune`` and counted separately. ``on_finish(job)`` gets the
+    final counts. ``stop`` pauses a broadcast at a checkpoint for a restart.
+    """
+
+    def __init__(self, bot, audience, checkpoint_path, prune=None, on_finish=None,
+                 rate=GLOBAL_RATE, workers=WORKERS, progress_interval=PROGRESS_INTERVAL):
+        self.bot = bot
+        self.audience = audience
+        self.checkpoint_path = checkpoint_path
+        self.prune = prune
+        self.on_finish = on_finish
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self.bucket = TokenBucket(rate)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.job = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, admin_chat_id, payload, segment="all"):
+        """Start a broadcast to ``segment``; ``payload`` is {"type": "text", "text": ...}
+        or {"type": "copy", "from_chat_id": ..., "message_id": ...}.
+        Returns False if another broadcast is still running."""
+        with self._lock:
+            if self.is_running():
+                return False
+            target = "" if segment == "all" else f" to {segment}"
+            progress = self.bot.send_message(admin_chat_id, f"📢 Broadcast{target} starting...", parse_mode=None)
+            self.job = {
+                "payload": payload,
+                "segment": segment,
+                "admin_chat_id": admin_chat_id,
+                "progress_message_id": progress.message_id,
+                "cursor": None,
+                "sent": 0,
+                "failed": 0,
+                "pruned": 0,
+                "started_at": time.time(),
+            }
+            self._save_checkpoint()
+            self._spawn()
+        return True
+
+    def resume(self):
+        """Continue a broadcast interrupted by a restart, if a checkpoint exists"""
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                job = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Ignoring unreadable broadcast checkpoint {self.checkpoint_path}: {e}")
+            return False
+        with self._lock:
+            if self.is_running():
+                return False
+            self.job = job
+            logger.info(f"Resuming broadcast after user {job['cursor']} ({job['sent']} already sent)")
+            self._spawn()
+        return True
+
+    def stop(self, timeout):
+        """Stop handing out recipients, let the ones in flight finish and save
+        the checkpoint, so ``resume`` continues after a restart. Returns False
+        if the broadcast did not stop within ``timeout`` seconds."""
+        self._stopping.set()
+        thread = self._thread
+        if thread is None:
+            return True
+        thread.join(timeout)
+        return not thread.is_alive()
+
+    def _spawn(self):
+        self._thread = threading.Thread(target=self._run, name="broadcast", daemon=True)
+        self._thread.start()
+
+    def _save_checkpoint(self):
+        try:
+            atomic_write_json(self.checkpoint_path, self.job)
+        except OSError as e:
+            logger.error(f"Failed to write broadcast checkpoint: {e}")
+
+    def _send(self, chat_id):
+        payload = self.job["payload"]
+        if payload["type"] == "copy":
+            self.bot.copy_message(chat_id, payload["from_chat_id"], payload["message_id"])
+        else:
+            self.bot.send_message(chat_id, payload["text"])
+
+    def _deliver(self, chat_id):
+        """Send to one chat, retrying transient errors; returns sent/failed/pruned"""
+        for attempt in range(MAX_ATTEMPTS):
+            self.bucket.acquire()
+            try:
+                self._send(chat_id)
+                return "sent"
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    # retry_after also covers the per-chat limit of one message per second
+                    self.bucket.pause(retry_after(e))
+                    continue
+                if is_unreachable(e):
+                    if self.prune:
+                        self.prune(chat_id)
+                    return "pruned"
+                logger.warning(f"Failed to send broadcast to {chat_id}: {e}")
+                return "failed"
+            except Exception as e:
+                logger.warning(f"Broadcast to {chat_id} failed (attempt {attempt + 1}): {e}")
+                time.sleep(2 ** attempt)
+        return "failed"
+
+    def _run(self):
+        job = self.job
+        segment = job.get("segment", "all")
+        total = job["sent"] + job["failed"] + job["pruned"] + self.audience.count(segment, job["cursor"])
+
+        tasks = queue.Queue(maxsize=self.workers * 2)
+        done = {}
+        done_lock = threading.Lock()
+
+        def worker():
+            while True:
+                item = tasks.get()
+                if item is None:
+                    return
+                index, chat_id = item
+                result = self._deliver(chat_id)
+                with done_lock:
+                    done[index] = (result, chat_id)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(self.workers)]
+        for t in threads:
+            t.start()
+
+        next_index = 0
+        last_progress = time.monotonic()
+
+        def advance():
+            # Move the cursor over the contiguous prefix of finished recipients
+            nonlocal next_index
+            with done_lock:
+                while next_index in done:
+                    result, chat_id = done.pop(next_index)
+                    job[result] += 1
+                    job["cursor"] = chat_id
+                    next_index += 1
+
+        paused = False
+        for index, chat_id in enumerate(self.audience.iter(segment, job["cursor"])):
+            if self._stopping.is_set():
+                paused = True
+                break
+            tasks.put((index, chat_id))
+            if time.monotonic() - last_progress >= self.progress_interval:
+                advance()
+                self._save_checkpoint()
+                self._report(total)
+                last_progress = time.monotonic()
+        for _ in threads:
+            tasks.put(None)
+        for t in threads:
+            t.join()
+        advance()
+        if paused:
+            self._save_checkpoint()
+            self._report(total)
+            logger.info(f"Broadcast paused after user {job['cursor']} for shutdown")
+            return
+        self._finish(total)
+
+    def _progress_text(self, total, final=False):
+        job = self.job
+        handled = job["sent"] + job["failed"] + job["pruned"]
+        title = "✅ Broadcast Results:" if final else f"📢 Broadcasting... {handled}/{total}"
+        return (f"{title}\n• Sent: {job['sent']} users\n• Failed: {job['failed']} users\n"
+                f"• Removed (blocked the bot): {job['pruned']} users")
+
+    def _report(self, total):
+        try:
+            self.bot.edit_message_text(self._progress_text(total), self.job["admin_chat_id"],
+                                       self.job["progress_message_id"])
+        except Exception as e:
+            logger.debug(f"Progress update failed: {e}")
+
+    def _finish(self, total):
+        elapsed = time.time() - self.job["started_at"]
+        text = self._progress_text(total, final=True) + f"\n• Took: {elapsed:.0f}s"
+        try:
+            os.remove(self.checkpoint_path)
+        except FileNotFoundError:
+            pass
+        try:
+            self.bot.send_message(self.job["admin_chat_id"], text,
+                                  reply_parameters=types.ReplyParameters(self.job["progress_message_id"]))
+        except Exception as e:
+            logger.error(f"Failed to send broadcast report: {e}")
+        logger.info(text)
+        if self.on_finish:
+            self.on_finish(self.job)
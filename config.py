@@ -1,8 +1,11 @@
 blocked = "bot was blocked by the user"
-start = "Heyy! 😘 For *content selling only*, no random chats or chika pls! 😌💋"
+start = """
+🌟 *Welcome to PINAY ATABS Bot!* 🌟
+
+😘 For *content selling only*, no random chats or chika pls! 😌💋
+
+📱 Type keywords like 'VIP', 'magkano', or 'pano bumili' to get pricing info!
+    """
 ban = "you were banned by the admin!"
 unban = "you were unbanned by the admin."
-text_message = "Message that would be sent if somebody writes any text"
 banned = "you are blocked"
-main_id = 7712850427
-TOKEN = "7740611922:AAHcawCFoYGgHgd5ZjeyuZuxVGaog2l2qBk"
@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import logging
+import threading
+
+from metrics import registry
+from shard import shard_path
+from storage import open_connection
+
+logger = logging.getLogger(__name__)
+
+# Bans share the state database with users, message links and the outbox
+DB_PATH = shard_path(os.getenv("STATE_DB", "bot_state.db"))
+
+# `blocked` holds banned users (`until` is the expiry of a temporary ban as a
+# unix time, NULL if permanent). Subscribers and message links used to live
+# here too, in the `user` and `USERS` tables of users.db; see migrate_legacy.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocked (user_id INTEGER PRIMARY KEY, until INTEGER);
+"""
+
+# Statements are module constants so each connection's statement cache
+# compiles them once and reuses the prepared form.
+SQL_IS_BLOCKED = "SELECT 1 FROM blocked WHERE user_id = ?"
+SQL_BLOCK = "INSERT INTO blocked (user_id, until) SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM blocked WHERE user_id = ?)"
+SQL_SET_BAN_EXPIRY = "UPDATE blocked SET until = ? WHERE user_id = ?"
+SQL_UNBLOCK = "DELETE FROM blocked WHERE user_id = ?"
+SQL_ALL_BLOCKED = "SELECT user_id, until FROM blocked"
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+def connection():
+    """This thread's connection to the ban database (WAL mode, created on first use)"""
+    global _schema_ready
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = open_connection(DB_PATH)
+        conn.execute("PRAGMA busy_timeout=5000")
+        with _schema_lock:
+            if not _schema_ready:
+                conn.executescript(SCHEMA)
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(blocked)")]
+                if "until" not in columns:
+                    conn.execute("ALTER TABLE blocked ADD COLUMN until INTEGER")
+                _schema_ready = True
+        _local.conn = conn
+    return conn
+
+@registry.timed("storage_seconds", op="plugin_db_write")
+def _write(sql, params):
+    conn = connection()
+    with conn:
+        return conn.execute(sql, params).rowcount
+
+def is_blocked(user_id):
+    return connection().execute(SQL_IS_BLOCKED, (user_id,)).fetchone() is not None
+
+def block(user_id, until=None):
+    """Add a user to the blocklist, until a unix time or for good; returns True if
+    they were not blocked before (an existing ban just gets the new expiry)"""
+    if _write(SQL_BLOCK, (user_id, until, user_id)) > 0:
+        return True
+    _write(SQL_SET_BAN_EXPIRY, (until, user_id))
+    return False
+
+def block_many(bans):
+    """Write many (user_id, until) bans in one transaction"""
+    conn = connection()
+    with conn:
+        for user_id, until in bans:
+            if conn.execute(SQL_BLOCK, (user_id, until, user_id)).rowcount == 0:
+                conn.execute(SQL_SET_BAN_EXPIRY, (until, user_id))
+
+def all_blocked():
+    """Every ban as a (user_id, until) pair"""
+    return connection().execute(SQL_ALL_BLOCKED).fetchall()
+
+def unblock(user_id):
+    """Remove a user from the blocklist; returns True if they were blocked"""
+    return _write(SQL_UNBLOCK, (user_id,)) > 0
+
+def migrate_legacy(path, state, links, blocklist):
+    """Import the old plugin database (subscribers, message links and bans) into
+    the shared store once, then rename it to ``path + ".migrated"``"""
+    if not os.path.exists(path) or os.path.abspath(path) == os.path.abspath(DB_PATH):
+        return False
+    conn = sqlite3.connect(path)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        users = [row[0] for row in conn.execute("SELECT user_id FROM user")] if "user" in tables else []
+        message_links = conn.execute("SELECT messageid, user_id FROM USERS").fetchall() if "USERS" in tables else []
+        bans = []
+        if "blocked" in tables:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(blocked)")]
+            until = "until" if "until" in columns else "NULL"
+            bans = conn.execute(f"SELECT user_id, {until} FROM blocked").fetchall()
+    finally:
+        conn.close()
+    for user_id in users:
+        state.add_user(user_id)
+    # A message linked to several users becomes a reply-to-many link
+    by_message = {}
+    for message_id, user_id in message_links:
+        by_message.setdefault(message_id, []).append(user_id)
+    links.add_many((m, u[0]) for m, u in by_message.items() if len(u) == 1)
+    for message_id, user_ids in by_message.items():
+        if len(user_ids) > 1:
+            links.add_fanout(message_id, user_ids)
+    blocklist.import_bans(bans)
+    os.replace(path, path + ".migrated")
+    logger.info(f"Migrated {path}: {len(users)} users, {len(message_links)} links, {len(bans)} bans")
+    return True
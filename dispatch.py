@@ -0,0 +1,61 @@
+import asyncio
+import logging
+import importlib
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Command -> "module:function" of the plugin that handles it. Nothing is
+# imported at startup; a plugin module is loaded the first time one of its
+# commands is used. Handlers are called as handler(message, bot).
+ROUTES = {
+    "start": "plugins.start:start",
+    "ban": "plugins.ban:blocked",
+    "unban": "plugins.unban:unblocked",
+    "everyone": "plugins.everyone_message:message_everyone",
+    "exportbans": "plugins.bans:export_bans",
+    "importbans": "plugins.bans:import_bans",
+}
+
+_handlers = {}
+_lock = threading.Lock()
+
+def resolve(target):
+    """The handler function for ``target``, importing its module on first use"""
+    handler = _handlers.get(target)
+    if handler is None:
+        with _lock:
+            handler = _handlers.get(target)
+            if handler is None:
+                module_name, function_name = target.split(":")
+                handler = getattr(importlib.import_module(module_name), function_name)
+                _handlers[target] = handler
+                logger.info(f"Loaded plugin {target}")
+    return handler
+
+def loaded():
+    return sorted(_handlers)
+
+def _lazy(target):
+    def handler(message, bot):
+        return resolve(target)(message, bot)
+    # Named after the plugin function so per-handler metrics stay readable
+    handler.__name__ = target.split(":")[1]
+    return handler
+
+def _lazy_async(target, sync_bot):
+    async def handler(message):
+        await asyncio.to_thread(lambda: resolve(target)(message, sync_bot))
+    handler.__name__ = target.split(":")[1]
+    return handler
+
+def register(bot, routes=ROUTES):
+    """Register every routed command on a TeleBot; call before catch-all handlers"""
+    for command, target in routes.items():
+        bot.register_message_handler(_lazy(target), commands=[command], pass_bot=True)
+
+def register_async(bot, sync_bot, routes=ROUTES):
+    """Register the same commands on an AsyncTeleBot. Plugins are synchronous, so
+    they run on a worker thread and reply through ``sync_bot``."""
+    for command, target in routes.items():
+        bot.register_message_handler(_lazy_async(target, sync_bot), commands=[command])
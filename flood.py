@@ -0,0 +1,154 @@
+import time
+import logging
+import threading
+
+from telebot.handler_backends import BaseMiddleware, CancelUpdate
+
+logger = logging.getLogger(__name__)
+
+PASS = "pass"
+COALESCE = "coalesce"
+MUTED = "muted"
+
+class UserBucket:
+    """Per-user flood state; __slots__ keeps each entry small at 100k+ users"""
+    __slots__ = ("tokens", "updated", "offenses", "offended_at", "muted_until",
+                 "media_group_id", "chat_id", "pending", "pending_since", "samples")
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.updated = now
+        self.offenses = 0
+        self.offended_at = 0.0
+        self.muted_until = 0.0
+        self.media_group_id = None
+        self.chat_id = None
+        self.pending = 0
+        self.pending_since = 0.0
+        self.samples = None
+
+class FloodGuard:
+    """Per-user token buckets in front of the handlers.
+
+    Each user may send ``burst`` messages at once and ``rate`` per second after
+    that. Messages over the limit are not handled individually; they are
+    counted and passed to ``on_digest`` as one summary ``digest_window``
+    seconds after the flood started. A user who triggers ``mute_after`` digests
+    within ``offense_window`` seconds is muted for ``mute_duration`` seconds.
+    Idle users are swept from memory after ``idle_ttl`` seconds.
+    """
+
+    def __init__(self, on_digest, rate=1.0, burst=5, digest_window=30, mute_after=3,
+                 mute_duration=600, offense_window=3600, idle_ttl=900, max_samples=3):
+        self.on_digest = on_digest
+        self.rate = rate
+        self.burst = burst
+        self.digest_window = digest_window
+        self.mute_after = mute_after
+        self.mute_duration = mute_duration
+        self.offense_window = offense_window
+        self.idle_ttl = idle_ttl
+        self.max_samples = max_samples
+        self.coalesced = 0
+        self.muted_dropped = 0
+        self._users = {}
+        self._pending = set()
+        self._idle_swept = time.monotonic()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._sweep_loop, name="flood-sweeper", daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._users)
+
+    def check(self, user_id, chat_id, media_group_id=None, sample=None):
+        """Decide what to do with one incoming message: PASS, COALESCE or MUTED"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._users.get(user_id)
+            if bucket is None:
+                bucket = self._users[user_id] = UserBucket(self.burst, now)
+            if now < bucket.muted_until:
+                self.muted_dropped += 1
+                return MUTED
+            # The rest of an album that was let through is not counted again
+            if media_group_id and media_group_id == bucket.media_group_id:
+                return PASS
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                bucket.media_group_id = media_group_id
+                return PASS
+            if not bucket.pending:
+                bucket.pending_since = now
+                bucket.chat_id = chat_id
+                bucket.samples = []
+                self._pending.add(user_id)
+            bucket.pending += 1
+            if sample and len(bucket.samples) < self.max_samples:
+                bucket.samples.append(sample)
+            self.coalesced += 1
+            return COALESCE
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(1)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Flood sweep failed: {e}")
+
+    def sweep(self):
+        """Emit due digests, apply mutes and forget idle users"""
+        now = time.monotonic()
+        digests = []
+        with self._lock:
+            for user_id in list(self._pending):
+                bucket = self._users[user_id]
+                if now - bucket.pending_since >= self.digest_window:
+                    self._pending.discard(user_id)
+                    if now - bucket.offended_at > self.offense_window:
+                        bucket.offenses = 0
+                    bucket.offenses += 1
+                    bucket.offended_at = now
+                    muted = bucket.offenses >= self.mute_after
+                    if muted:
+                        bucket.muted_until = now + self.mute_duration
+                        bucket.offenses = 0
+                    digests.append((user_id, bucket.chat_id, bucket.pending, bucket.samples, muted))
+                    bucket.pending = 0
+                    bucket.samples = None
+            # Full scan for idle users only once a minute
+            if now - self._idle_swept >= 60:
+                self._idle_swept = now
+                idle = [user_id for user_id, bucket in self._users.items()
+                        if not bucket.pending and now >= bucket.muted_until
+                        and now - bucket.updated > self.idle_ttl]
+                for user_id in idle:
+                    del self._users[user_id]
+        for user_id, chat_id, count, samples, muted in digests:
+            try:
+                self.on_digest(user_id, chat_id, count, samples, muted)
+            except Exception as e:
+                logger.error(f"Failed to send flood digest for {user_id}: {e}")
+
+class FloodMiddleware(BaseMiddleware):
+    """TeleBot middleware that runs every user message through a FloodGuard"""
+
+    def __init__(self, guard, exempt_ids=()):
+        self.update_types = ["message"]
+        self.guard = guard
+        self.exempt_ids = set(exempt_ids)
+
+    def pre_process(self, message, data):
+        if message.from_user.id in self.exempt_ids:
+            return None
+        sample = (message.text or message.caption or f"[{message.content_type}]")[:100]
+        verdict = self.guard.check(message.from_user.id, message.chat.id, message.media_group_id, sample)
+        if verdict != PASS:
+            return CancelUpdate()
+        return None
+
+    def post_process(self, message, data, exception):
+        pass
@@ -0,0 +1,70 @@
+import os
+import time
+import signal
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds from SIGTERM to the end of shutdown. Heroku kills a dyno 30s after
+# SIGTERM, so the default leaves time for closing the outbox and flushing files.
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))
+
+_deadline = None
+_deadline_lock = threading.Lock()
+
+def remaining(timeout=SHUTDOWN_TIMEOUT):
+    """Seconds left until the shutdown deadline; the first call starts the clock"""
+    global _deadline
+    with _deadline_lock:
+        if _deadline is None:
+            _deadline = time.monotonic() + timeout
+        return max(0.0, _deadline - time.monotonic())
+
+def _on_signal(signum, frame):
+    # Only the first signal interrupts; another one must not abort the drain
+    signal.signal(signum, signal.SIG_IGN)
+    remaining()
+    logger.info(f"{signal.Signals(signum).name} received; shutting down within {SHUTDOWN_TIMEOUT:.0f}s")
+    raise KeyboardInterrupt
+
+def handle_signals():
+    """Make SIGTERM stop the main thread the way Ctrl-C does, so every run mode
+    leaves its intake loop and reaches its shutdown code. Call from the main thread."""
+    signal.signal(signal.SIGTERM, _on_signal)
+
+def ignore_signals():
+    """For child processes that are stopped by their parent, not by signals sent
+    to the whole process group"""
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def wait_for(condition, timeout, interval=0.05):
+    """Poll ``condition`` until it is true or ``timeout`` seconds pass; returns
+    whether it came true"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+def drain(steps):
+    """Run shutdown ``steps``, (name, step(timeout)) pairs, in order.
+
+    Each step gets whatever is left of the shutdown deadline and returns
+    False if it had to give up with work left over. A failing step is logged
+    and the rest still run.
+    """
+    for name, step in steps:
+        started = time.monotonic()
+        try:
+            finished = step(remaining())
+        except Exception as e:
+            logger.error(f"Shutdown step {name} failed: {e}")
+            continue
+        elapsed = time.monotonic() - started
+        if finished is False:
+            logger.warning(f"Shutdown: {name} not drained before the deadline ({elapsed:.1f}s)")
+        else:
+            logger.info(f"Shutdown: {name} drained in {elapsed:.2f}s")
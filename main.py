@@ -1,20 +1,27 @@
 import os
-from telebot import TeleBot, types
-import json
+import sys
+from telebot import types, util
 import logging
-
-# Security: Use environment variables for sensitive data
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-ADMIN_ID = int(os.getenv('ADMIN_ID', '0'))
-
-# Validate required environment variables
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN environment variable is required!")
-if ADMIN_ID == 0:
-    raise ValueError("ADMIN_ID environment variable is required!")
-
-# Initialize bot
-bot = TeleBot(BOT_TOKEN, parse_mode="Markdown")
+import config
+import db
+import dispatch
+import lifecycle
+import metrics
+import segments
+import shard
+from shard import shard_path
+from blocklist import blocklist, BlocklistMiddleware
+from media_cache import MediaCache
+from triggers import TriggerEngine
+from activity_log import ActivityLog, query as query_log
+from albums import MediaGroupBuffer
+from flood import FloodGuard, FloodMiddleware
+# The shared bot, storage and senders; plugins/ use the same instances
+from services import (
+    BOT_TOKEN,  # not used here; re-exported for async_bot (core.BOT_TOKEN)
+    ADMIN_ID, SHARD_LABEL, bot, stats, state, links, outbox, audience, broadcaster,
+    save_user, log_message_link, get_original_user,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,96 +31,247 @@ logger = logging.getLogger(__name__)
 USERS_FILE = "users.json"
 SEEN_VIP_FILE = "seen_vip_users.json"
 MSG_MAP_FILE = "msg_map.json"
-LOG_FILE = "bot_log.txt"
-
-def ensure_files_exist():
-    """Ensure all required JSON files exist with proper structure"""
-    files_config = {
-        USERS_FILE: [],
-        SEEN_VIP_FILE: [],
-        MSG_MAP_FILE: {}
-    }
-    
-    for filepath, default_content in files_config.items():
-        if not os.path.exists(filepath):
-            try:
-                with open(filepath, "w", encoding="utf-8") as f:
-                    json.dump(default_content, f, indent=2)
-                logger.info(f"Created {filepath}")
-            except Exception as e:
-                logger.error(f"Failed to create {filepath}: {e}")
-
-def safe_json_operation(filepath, operation, default_value=None):
-    """Safely perform JSON file operations with error handling"""
-    try:
-        if operation == "read":
-            with open(filepath, "r", encoding="utf-8") as f:
-                return json.load(f)
-        elif operation == "write":
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(default_value, f, indent=2, ensure_ascii=False)
-            return True
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        logger.error(f"JSON operation failed for {filepath}: {e}")
-        return [] if filepath != MSG_MAP_FILE else {}
-    except Exception as e:
-        logger.error(f"Unexpected error with {filepath}: {e}")
-        return [] if filepath != MSG_MAP_FILE else {}
+LOG_FILE = shard_path("bot_log.jsonl")
+MEDIA_CACHE_FILE = shard_path("media_cache.json")
+TRIGGERS_FILE = "triggers.json"
+LEGACY_PLUGIN_DB = "users.db"
+VIP_OFFER_IMAGE = os.getenv("VIP_OFFER_IMAGE", "vip_offer.png")
 
-def save_user(user_id):
-    """Save user ID to users list"""
-    users = safe_json_operation(USERS_FILE, "read") or []
-    user_str = str(user_id)
-    
-    if user_str not in users:
-        users.append(user_str)
-        safe_json_operation(USERS_FILE, "write", users)
-        logger.info(f"New user saved: {user_id}")
+# Runtime mode: "polling" (threaded TeleBot), "async" (AsyncTeleBot) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Webhook mode: PORT is set by Heroku for web dynos
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+# Per-user flood control: burst size, sustained messages/second and auto-mute length
+FLOOD_BURST = int(os.getenv("FLOOD_BURST", "5"))
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", "1"))
+FLOOD_MUTE_MINUTES = int(os.getenv("FLOOD_MUTE_MINUTES", "10"))
+
+# Local Prometheus endpoint; METRICS_PORT=0 disables it
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+media = MediaCache(MEDIA_CACHE_FILE)
+triggers = TriggerEngine(TRIGGERS_FILE)
+activity = ActivityLog(LOG_FILE)
+albums = MediaGroupBuffer(lambda messages: handle_album(messages))
+flood = FloodGuard(
+    lambda *digest: send_flood_digest(*digest),
+    rate=FLOOD_RATE,
+    burst=FLOOD_BURST,
+    mute_duration=FLOOD_MUTE_MINUTES * 60,
+)
+bot.setup_middleware(metrics.MetricsMiddleware())
+# Flood control first: a banned user who floods must not get a notice per message
+bot.setup_middleware(FloodMiddleware(flood, exempt_ids=[ADMIN_ID]))
+bot.setup_middleware(BlocklistMiddleware(blocklist, on_blocked=lambda message: notify_banned(message)))
+
+metrics.registry.gauge("activity_log_queue_depth", activity.queued)
+metrics.registry.gauge("album_groups_pending", lambda: len(albums))
+metrics.registry.gauge("flood_tracked_users", lambda: len(flood))
+metrics.registry.gauge("message_links_hot", lambda: links.stats()["hot_entries"])
+metrics.registry.gauge("outbox_pending", lambda: len(outbox))
+metrics.registry.gauge("outbox_dead_letters", outbox.dead_count)
+metrics.registry.gauge("broadcast_running", lambda: int(broadcaster.is_running()))
 
 def has_seen_vip(user_id):
     """Check if user has already seen VIP offer"""
-    seen_users = safe_json_operation(SEEN_VIP_FILE, "read") or []
-    return str(user_id) in seen_users
+    return state.has_seen_vip(user_id)
 
 def mark_seen_vip(user_id):
     """Mark user as having seen VIP offer"""
-    seen_users = safe_json_operation(SEEN_VIP_FILE, "read") or []
-    user_str = str(user_id)
+    if state.mark_seen_vip(user_id):
+        stats.record("vip_offer", user_id)
+
+def log_user_activity(message):
+    """Queue a user activity record for the background log writer"""
+    state.touch(message.from_user.id)
+    activity.record(message.from_user.id, message.chat.id, message.content_type, describe_content(message))
+    stats.record("messages", message.from_user.id)
+    stats.record(f"message_{message.content_type}")
+
+def on_forwarded(forwarded, user_id):
+    """Outbox callback: link a delivered forward to its sender"""
+    log_message_link(forwarded.message_id, user_id)
+
+def on_album_forwarded(forwarded, user_id):
+    """Outbox callback: link every message of a forwarded album in one write"""
+    links.add_many((f.message_id, user_id) for f in forwarded)
+    stats.record("forward", count=len(forwarded))
+
+def on_admin_reply_sent(sent, admin_chat_id, reply_to, items=1):
+    stats.record("admin_reply")
+    text = f"✅ Album sent successfully! ({items} items)" if items > 1 else "✅ Message sent successfully!"
+    outbox.send("send_message", admin_chat_id, text, reply_to=reply_to)
+
+def on_admin_reply_dead(error, admin_chat_id, reply_to, items=1):
+    outbox.send("send_message", admin_chat_id, f"❌ Failed to send message: {error}",
+                parse_mode=None, reply_to=reply_to)
+
+def on_fanout_reply_sent(sent):
+    # Replies to many are acknowledged once when queued; failures are in /outbox
+    stats.record("admin_reply")
+
+outbox.register("forward", on_sent=on_forwarded)
+outbox.register("album_forward", on_sent=on_album_forwarded)
+outbox.register("admin_reply", on_sent=on_admin_reply_sent, on_dead=on_admin_reply_dead)
+outbox.register("fanout_reply", on_sent=on_fanout_reply_sent)
+
+VIP_CAPTION = """
+🔥 *Buy PINAY ATABS VIP Access for only ₱499!*
+
+🖼️ *What you get:*
+• Exclusive TG channel content
+• Full set access 👀
+• Premium quality content
+• Instant access after payment
+
+💰 *Choose your payment method:*
+    """
+
+def build_vip_markup():
+    """Create payment buttons"""
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    gcash_btn = types.InlineKeyboardButton(
+        "🟡 GCash / Maya Payment", 
+        url="https://t.me/PhScan2Pabot?startapp=Gcash_Maya"
+    )
+    crypto_btn = types.InlineKeyboardButton(
+        "🔵 Crypto Payment", 
+        url="https://t.me/Cryptopayphbot?startapp=Crypto"
+    )
+    markup.add(gcash_btn, crypto_btn)
+    return markup
+
+# Serialized once at startup; TeleBot passes pre-serialized markup through as-is
+VIP_MARKUP = build_vip_markup().to_json()
+
+def is_admin_reply(message):
+    """Check if a message is the admin replying to a forwarded message"""
+    return bool(message.reply_to_message) and message.from_user.id == ADMIN_ID
+
+def match_trigger(message):
+    """Trigger rule matched by a message's text or caption; admin replies and albums never trigger"""
+    if is_admin_reply(message) or message.media_group_id:
+        return None
+    return triggers.match(message)
+
+def build_stats_text():
+    """Build the /stats report from in-memory counters"""
+    total_users = state.user_count()
+    seen_vip = state.seen_vip_count()
+    link_stats = links.stats()
+    report = stats.report()
+    today, yesterday, week = report["today"], report["yesterday"], report["week"]
     
-    if user_str not in seen_users:
-        seen_users.append(user_str)
-        safe_json_operation(SEEN_VIP_FILE, "write", seen_users)
-
-def log_message_link(forwarded_msg_id, user_id):
-    """Link forwarded message ID to original user"""
-    msg_map = safe_json_operation(MSG_MAP_FILE, "read") or {}
-    msg_map[str(forwarded_msg_id)] = user_id
-    safe_json_operation(MSG_MAP_FILE, "write", msg_map)
-
-def get_original_user(reply_msg_id):
-    """Get original user ID from forwarded message ID"""
-    msg_map = safe_json_operation(MSG_MAP_FILE, "read") or {}
-    return msg_map.get(str(reply_msg_id))
-
-def log_user_activity(user_id, content):
-    """Log user activity to file"""
-    try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"{user_id} - {content}\n")
-    except Exception as e:
-        logger.error(f"Failed to log activity: {e}")
+    def row(label, event):
+        return f"• {label}: {today[event]} / {yesterday[event]} / {week[event]}"
+    
+    activity_rows = "\n".join([
+        row("New users", "new_user"),
+        row("Messages", "messages"),
+        row("VIP offers shown", "vip_offer"),
+        row("Forwards", "forward"),
+        row("Admin replies", "admin_reply"),
+        row("Broadcast deliveries", "broadcast_sent"),
+    ])
+    
+    return f"""
+📊 *Bot Statistics{SHARD_LABEL}:*
+
+👥 Total Users: {total_users}
+👀 Seen VIP Offer: {seen_vip}
+🆕 New Potential: {total_users - seen_vip}
+
+📅 *Today / Yesterday / 7 days:*
+{activity_rows}
+• Active users: {report['dau']} today, {report['wau']} in 7 days
+• VIP offer rate (7d): {report['vip_conversion']:.0%} of new users
+• Broadcast delivery (7d): {report['broadcast_delivery']:.0%}
 
-@bot.message_handler(commands=['start'])
-def send_welcome(message):
-    """Handle /start command"""
-    welcome_text = """
-🌟 *Welcome to PINAY ATABS Bot!* 🌟
+🔗 *Reply Index:*
+• Hot entries: {link_stats['hot_entries']}
+• Hits: {link_stats['hits']} (+{link_stats['cold_hits']} from disk)
+• Misses: {link_stats['misses']}
+• Evicted: {link_stats['evictions']} / Expired: {link_stats['expired']}
 
-😘 For *content selling only*, no random chats or chika pls! 😌💋
+📮 *Outbox:*
+• Pending: {len(outbox)} / Dead letters: {outbox.dead_count()}
+• Sent: {outbox.sent} / Retried: {outbox.retried}
 
-📱 Type keywords like 'VIP', 'magkano', or 'pano bumili' to get pricing info!
+🌊 *Flood Control:*
+• Tracked users: {len(flood)}
+• Coalesced: {flood.coalesced} / Dropped while muted: {flood.muted_dropped}
     """
-    bot.reply_to(message, welcome_text)
+
+def build_dead_letters_text():
+    """Plain-text list of the latest outbox dead letters"""
+    rows = outbox.dead_letters()
+    if not rows:
+        return f"📮{SHARD_LABEL} No dead letters. {len(outbox)} messages pending."
+    lines = [f"📮{SHARD_LABEL} {outbox.dead_count()} dead letters, {len(outbox)} pending. Latest:"]
+    lines += [f"#{job_id} {method} → {chat_id} ({attempts} attempts): {error}"
+              for job_id, chat_id, method, attempts, error in rows]
+    lines.append("Use /replay <id> or /replay all")
+    return "\n".join(lines)
+
+def relay_reply(messages, reply_msg_id):
+    """Copy the admin's reply (one message or a whole album) to the user, or every
+    user, behind the replied-to message; returns how many users it was queued for.
+
+    copy_message passes any message type through by reference in one call,
+    keeping captions, entities and formatting; nothing is downloaded.
+    """
+    first = messages[0]
+    ids = [m.message_id for m in messages]
+    method, ref = ("copy_message", ids[0]) if len(ids) == 1 else ("copy_messages", ids)
+    users = links.fanout(reply_msg_id)
+    if users:
+        for user_id in users:
+            outbox.send(method, user_id, first.chat.id, ref, callback="fanout_reply")
+        bot.reply_to(first, f"📨 Sending to {len(users)} users...")
+        return len(users)
+    target_user = get_original_user(reply_msg_id)
+    if not target_user:
+        bot.reply_to(first, "⚠️ Cannot find the original user for this reply.")
+        return 0
+    # Confirmed (or reported as failed) by the outbox callbacks once delivered
+    outbox.send(method, target_user, first.chat.id, ref, callback="admin_reply",
+                context={"admin_chat_id": first.chat.id, "reply_to": first.message_id, "items": len(ids)})
+    return 1
+
+def describe_content(message):
+    """Short description of a message for the activity log"""
+    if message.text:
+        return message.text[:100] + "..." if len(message.text) > 100 else message.text
+    elif message.photo:
+        return "[PHOTO]"
+    elif message.video:
+        return "[VIDEO]"
+    elif message.voice:
+        return "[VOICE]"
+    elif message.document:
+        return "[DOCUMENT]"
+    elif message.sticker:
+        return "[STICKER]"
+    elif message.animation:
+        return "[GIF]"
+    elif message.video_note:
+        return "[VIDEO NOTE]"
+    return "[UNKNOWN MEDIA]"
+
+def notify_banned(message):
+    """Tell a banned user why nothing happens"""
+    bot.send_message(message.chat.id, config.banned)
+
+# /start, /ban, /unban and /everyone are plugins, imported on first use
+dispatch.register(bot)
 
 @bot.message_handler(commands=['broadcast'])
 def broadcast_message(message):
@@ -126,23 +284,37 @@ def broadcast_message(message):
         # Extract message text after command
         text = message.text.split(" ", 1)[1]
     except IndexError:
-        bot.reply_to(message, "❌ Please provide a message to broadcast.\n\n*Usage:* `/broadcast Your message here`")
-        return
+        text = ""
     
-    users = safe_json_operation(USERS_FILE, "read") or []
-    sent_count = 0
-    failed_count = 0
+    # "/broadcast to:active:7,not_blocked Hello" sends to a segment only
+    segment, text = segments.split_target(text)
+    if not text:
+        bot.reply_to(message, "❌ Please provide a message to broadcast.\n\n*Usage:* `/broadcast [to:segment] Your message here`")
+        return
+    try:
+        segments.parse(segment)
+    except ValueError as e:
+        bot.reply_to(message, f"❌ {e}\nFilters: {segments.describe()}", parse_mode=None)
+        return
     
-    for user_id in users:
-        try:
-            bot.send_message(user_id, f"📢 *Broadcast Message:*\n\n{text}")
-            sent_count += 1
-        except Exception as e:
-            failed_count += 1
-            logger.warning(f"Failed to send broadcast to {user_id}: {e}")
+    # Runs in the background; progress and the final report are sent to the admin
+    payload = {"type": "text", "text": f"📢 *Broadcast Message:*\n\n{text}"}
+    if not broadcaster.start(message.chat.id, payload, segment):
+        bot.reply_to(message, "⏳ A broadcast is already running. Please wait for it to finish.")
+
+@bot.message_handler(commands=['segment'])
+def count_segment(message):
+    """Count a broadcast segment without sending anything - Admin only"""
+    if message.from_user.id != ADMIN_ID:
+        return
     
-    result_msg = f"✅ Broadcast Results:\n• Sent: {sent_count} users\n• Failed: {failed_count} users"
-    bot.reply_to(message, result_msg)
+    segment = util.extract_arguments(message.text).strip() or "all"
+    try:
+        count = audience.count(segment)
+    except ValueError as e:
+        bot.reply_to(message, f"❌ {e}\nFilters: {segments.describe()}", parse_mode=None)
+        return
+    bot.reply_to(message, f"👥{SHARD_LABEL} Segment {segment}: {count} users", parse_mode=None)
 
 @bot.message_handler(commands=['stats'])
 def show_stats(message):
@@ -150,19 +322,75 @@ def show_stats(message):
     if message.from_user.id != ADMIN_ID:
         return
     
-    users = safe_json_operation(USERS_FILE, "read") or []
-    seen_vip = safe_json_operation(SEEN_VIP_FILE, "read") or []
+    bot.reply_to(message, build_stats_text())
+
+@bot.message_handler(commands=['metrics'])
+def show_metrics(message):
+    """Dump latency histograms and counters - Admin only"""
+    if message.from_user.id != ADMIN_ID:
+        return
+    
+    for chunk in util.smart_split(metrics.registry.summary(), 4000):
+        bot.send_message(message.chat.id, chunk, parse_mode=None)
+
+@bot.message_handler(commands=['outbox'])
+def show_dead_letters(message):
+    """List the most recent dead letters - Admin only"""
+    if message.from_user.id != ADMIN_ID:
+        return
     
-    stats_text = f"""
-📊 *Bot Statistics:*
+    for chunk in util.smart_split(build_dead_letters_text(), 4000):
+        bot.send_message(message.chat.id, chunk, parse_mode=None)
 
-👥 Total Users: {len(users)}
-👀 Seen VIP Offer: {len(seen_vip)}
-🆕 New Potential: {len(users) - len(seen_vip)}
-    """
-    bot.reply_to(message, stats_text)
+@bot.message_handler(commands=['replay'])
+def replay_dead_letters(message):
+    """Queue dead letters again - Admin only"""
+    if message.from_user.id != ADMIN_ID:
+        return
+    
+    arg = util.extract_arguments(message.text).strip()
+    if arg != "all" and not arg.isdigit():
+        bot.reply_to(message, "*Usage:* `/replay <id>` or `/replay all`")
+        return
+    count = outbox.replay(None if arg == "all" else int(arg))
+    bot.reply_to(message, f"🔁 Re-queued {count} messages.")
+
+@bot.message_handler(commands=['many'])
+def start_reply_to_many(message):
+    """Link a prompt to several users so one reply reaches them all - Admin only"""
+    if message.from_user.id != ADMIN_ID:
+        return
+    
+    # "/many 123 456", and/or sent as a reply to a forward to include its sender
+    user_ids = [int(arg) for arg in util.extract_arguments(message.text).split() if arg.isdigit()]
+    if message.reply_to_message:
+        reply_msg_id = message.reply_to_message.message_id
+        user_ids += links.fanout(reply_msg_id) or [u for u in [get_original_user(reply_msg_id)] if u]
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        bot.reply_to(message, "*Usage:* `/many <user_id> <user_id> ...` or reply `/many` to a forward")
+        return
+    prompt = bot.reply_to(message, f"👥 Reply to this message to write to {len(user_ids)} users.")
+    # Key the prompt to a user of this shard, so replies to it are routed here
+    local = [u for u in user_ids if shard.shard_of(u, shard.SHARD_COUNT) == shard.SHARD]
+    links.add_fanout(prompt.message_id, user_ids, key=(local or [ADMIN_ID])[0])
+
+@bot.message_handler(func=match_trigger, content_types=util.content_type_media)
+def handle_trigger(message):
+    """Run the action of the trigger rule a message matched"""
+    rule = match_trigger(message)
+    if rule is None:
+        # Rules were reloaded between the filter and the handler
+        handle_all_messages(message)
+    elif rule.action == "offer":
+        send_vip_offer(message)
+    elif rule.action == "reply":
+        bot.reply_to(message, rule.reply)
+    elif rule.action == "forward":
+        handle_all_messages(message)
+        outbox.send("send_message", ADMIN_ID, f"🔔 Trigger '{rule.name}' matched from user {message.from_user.id}",
+                    parse_mode=None)
 
-@bot.message_handler(func=lambda message: any(word in message.text.lower() for word in ['magkano', 'vip', 'pano bumili', 'buy vip', 'price', 'presyo']))
 def send_vip_offer(message):
     """Send VIP offer when triggered by keywords"""
     user_id = message.from_user.id
@@ -175,86 +403,33 @@ def send_vip_offer(message):
     # Mark user as having seen VIP offer
     mark_seen_vip(user_id)
     
-    # VIP offer message
-    caption = """
-🔥 *Buy PINAY ATABS VIP Access for only ₱499!*
-
-🖼️ *What you get:*
-• Exclusive TG channel content
-• Full set access 👀
-• Premium quality content
-• Instant access after payment
-
-💰 *Choose your payment method:*
-    """
-    
-    # Create payment buttons
-    markup = types.InlineKeyboardMarkup(row_width=1)
-    gcash_btn = types.InlineKeyboardButton(
-        "🟡 GCash / Maya Payment", 
-        url="https://t.me/PhScan2Pabot?startapp=Gcash_Maya"
-    )
-    crypto_btn = types.InlineKeyboardButton(
-        "🔵 Crypto Payment", 
-        url="https://t.me/Cryptopayphbot?startapp=Crypto"
-    )
-    markup.add(gcash_btn, crypto_btn)
-    
-    # Try to send with photo, fallback to text if no photo
+    # Try to send with photo (uploaded once, then by file_id), fallback to text if no photo
     try:
-        if os.path.exists("vip_offer.png"):
-            with open("vip_offer.png", 'rb') as photo:
-                bot.send_photo(message.chat.id, photo, caption=caption, reply_markup=markup)
+        if media.exists(VIP_OFFER_IMAGE):
+            media.send_photo(bot, message.chat.id, VIP_OFFER_IMAGE, caption=VIP_CAPTION, reply_markup=VIP_MARKUP)
         else:
-            bot.send_message(message.chat.id, caption, reply_markup=markup)
+            bot.send_message(message.chat.id, VIP_CAPTION, reply_markup=VIP_MARKUP)
     except Exception as e:
         logger.error(f"Failed to send VIP offer: {e}")
-        bot.send_message(message.chat.id, caption, reply_markup=markup)
+        bot.send_message(message.chat.id, VIP_CAPTION, reply_markup=VIP_MARKUP)
 
-@bot.message_handler(func=lambda message: message.reply_to_message and message.from_user.id == ADMIN_ID)
+@bot.message_handler(func=is_admin_reply, content_types=util.content_type_media)
 def handle_admin_reply(message):
     """Handle admin replies to forwarded messages"""
-    reply_msg_id = message.reply_to_message.message_id
-    target_user = get_original_user(reply_msg_id)
-    
-    if not target_user:
-        bot.reply_to(message, "⚠️ Cannot find the original user for this reply.")
+    if albums.add(message):
         return
     
-    try:
-        # Handle different message types
-        if message.text:
-            bot.send_message(target_user, message.text)
-        elif message.photo:
-            bot.send_photo(target_user, message.photo[-1].file_id, caption=message.caption)
-        elif message.video:
-            bot.send_video(target_user, message.video.file_id, caption=message.caption)
-        elif message.voice:
-            bot.send_voice(target_user, message.voice.file_id)
-        elif message.document:
-            bot.send_document(target_user, message.document.file_id, caption=message.caption)
-        elif message.sticker:
-            bot.send_sticker(target_user, message.sticker.file_id)
-        elif message.animation:
-            bot.send_animation(target_user, message.animation.file_id, caption=message.caption)
-        elif message.video_note:
-            bot.send_video_note(target_user, message.video_note.file_id)
-        else:
-            bot.reply_to(message, "⚠️ Unsupported media type.")
-            return
-        
-        bot.reply_to(message, "✅ Message sent successfully!")
-        
-    except Exception as e:
-        error_msg = f"❌ Failed to send message: {str(e)}"
-        bot.reply_to(message, error_msg)
-        logger.error(f"Admin reply failed: {e}")
+    relay_reply([message], message.reply_to_message.message_id)
 
-@bot.message_handler(func=lambda message: True)
+@bot.message_handler(func=lambda message: True, content_types=util.content_type_media)
 def handle_all_messages(message):
     """Handle all other messages - track users and forward to admin"""
     user_id = message.from_user.id
     
+    # Album items are handled together once the whole album has arrived
+    if albums.add(message):
+        return
+    
     # Save user to database
     save_user(user_id)
     
@@ -262,44 +437,118 @@ def handle_all_messages(message):
     if user_id == ADMIN_ID:
         return
     
-    # Forward message to admin
-    try:
-        forwarded = bot.forward_message(ADMIN_ID, message.chat.id, message.message_id)
-        log_message_link(forwarded.message_id, user_id)
-    except Exception as e:
-        logger.error(f"Failed to forward message from {user_id}: {e}")
+    # Forward message to admin; queued so a failed forward is retried, not lost
+    outbox.send("forward_message", ADMIN_ID, message.chat.id, message.message_id,
+                callback="forward", context={"user_id": user_id})
     
     # Log user activity
-    if message.text:
-        log_content = message.text[:100] + "..." if len(message.text) > 100 else message.text
-    elif message.photo:
-        log_content = "[PHOTO]"
-    elif message.video:
-        log_content = "[VIDEO]"
-    elif message.voice:
-        log_content = "[VOICE]"
-    elif message.document:
-        log_content = "[DOCUMENT]"
-    elif message.sticker:
-        log_content = "[STICKER]"
-    elif message.animation:
-        log_content = "[GIF]"
-    elif message.video_note:
-        log_content = "[VIDEO NOTE]"
-    else:
-        log_content = "[UNKNOWN MEDIA]"
+    log_user_activity(message)
+
+def send_flood_digest(user_id, chat_id, count, samples, muted):
+    """Send the admin one summary instead of every message from a flooding user"""
+    lines = [f"🌊 Flood digest: user {user_id} sent {count} more messages too fast"]
+    lines += [f"• {sample}" for sample in samples]
+    if muted:
+        lines.append(f"🔇 Auto-muted for {FLOOD_MUTE_MINUTES} minutes")
+    # Queued: the coalesced messages were never forwarded, the digest is their only trace.
+    # parse_mode=None: samples are raw user text. Replying to the digest reaches the user
+    # like replying to a forward, so it is linked the same way once sent.
+    outbox.send("send_message", ADMIN_ID, "\n".join(lines), parse_mode=None,
+                callback="forward", context={"user_id": user_id})
+
+def handle_album(messages):
+    """Handle a complete album: forward a user's album, or deliver the admin's reply album"""
+    first = messages[0]
+    user_id = first.from_user.id
+    
+    if user_id == ADMIN_ID:
+        reply = next((m.reply_to_message for m in messages if m.reply_to_message), None)
+        if reply:
+            # One copy_messages call delivers the whole album
+            relay_reply(messages, reply.message_id)
+        return
     
-    log_user_activity(user_id, log_content)
+    save_user(user_id)
+    
+    # One forward call and one link write for the whole album
+    outbox.send("forward_messages", ADMIN_ID, first.chat.id, [m.message_id for m in messages],
+                callback="album_forward", context={"user_id": user_id})
+    
+    state.touch(user_id)
+    activity.record(user_id, first.chat.id, "album", f"[ALBUM: {len(messages)} items]")
+    stats.record("messages", user_id)
+    stats.record("message_album")
+
+def startup(metrics_port=METRICS_PORT):
+    """Recount messages the last stats snapshot missed, resume interrupted
+    broadcasts and queued sends, and serve /metrics"""
+    if stats.saved_at is not None:
+        replayed = stats.replay(query_log(LOG_FILE, since=stats.saved_at))
+        logger.info(f"Stats: recounted {replayed} messages logged after the last snapshot")
+    broadcaster.resume()
+    outbox.start()
+    if metrics_port:
+        metrics.serve(metrics_port, METRICS_HOST)
+
+def drain_handlers(timeout):
+    """Let TeleBot's worker pool finish the updates polling already fetched"""
+    pool = bot.worker_pool if bot.threaded else None
+    if pool is None:
+        return True
+
+    def idle():
+        return pool.tasks.empty() and all(
+            not w.received_task_event.is_set() or w.done_event.is_set() or w.exception_event.is_set()
+            for w in pool.workers)
+
+    return lifecycle.wait_for(idle, timeout)
+
+def shutdown():
+    """Finish queued work within the shutdown deadline, then write the final
+    snapshots, flush logs and close every store"""
+    lifecycle.drain([
+        ("handlers", drain_handlers),
+        ("albums", albums.drain),
+        ("broadcast", broadcaster.stop),
+        ("outbox", outbox.drain),
+    ])
+    stats.close()
+    activity.close()
+    outbox.close()
+    audience.close()
+    links.close()
+    state.close()
 
 def main():
     """Main function to start the bot"""
-    ensure_files_exist()
-    logger.info("Bot starting...")
+    if BOT_MODE == "webhook":
+        import webhook
+        webhook.check_secret(WEBHOOK_SECRET)
+    lifecycle.handle_signals()
+    state.migrate_json(USERS_FILE, SEEN_VIP_FILE, MSG_MAP_FILE, links)
+    db.migrate_legacy(LEGACY_PLUGIN_DB, state, links, blocklist)
+    startup()
+    logger.info(f"Bot starting in {BOT_MODE} mode...")
     
     try:
-        bot.polling(none_stop=True, interval=0, timeout=20)
+        if BOT_MODE == "async":
+            import async_bot
+            async_bot.run(sys.modules[__name__])
+        elif BOT_MODE == "webhook":
+            import webhook
+            webhook.run(bot, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL,
+                        workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE)
+        else:
+            metrics.instrument_handlers(bot)
+            if bot.threaded:
+                metrics.registry.gauge("handler_queue_depth", bot.worker_pool.tasks.qsize)
+            bot.polling(none_stop=True, interval=0, timeout=20)
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         logger.error(f"Bot polling error: {e}")
+    finally:
+        shutdown()
 
 if __name__ == "__main__":
     main()
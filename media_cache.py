@@ -0,0 +1,95 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+
+from telebot.apihelper import ApiTelegramException
+
+from storage import atomic_write_json, load_json
+
+logger = logging.getLogger(__name__)
+
+class MediaCache:
+    """Telegram ``file_id`` cache for local media files, keyed by content hash.
+
+    A file is uploaded once; later sends reuse the ``file_id`` Telegram
+    returned. The file is re-hashed only when its size or mtime changes, and
+    those are checked at most every ``check_interval`` seconds.
+    """
+
+    def __init__(self, path="media_cache.json", check_interval=60):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._file_ids = load_json(path, {})
+        # filepath -> (checked_at, (size, mtime_ns), sha256 or None if missing)
+        self._files = {}
+
+    def digest(self, filepath):
+        """SHA-256 of the file's content, or None if it does not exist"""
+        now = time.monotonic()
+        cached = self._files.get(filepath)
+        if cached and now - cached[0] < self.check_interval:
+            return cached[2]
+        try:
+            st = os.stat(filepath)
+        except FileNotFoundError:
+            self._files[filepath] = (now, None, None)
+            return None
+        signature = (st.st_size, st.st_mtime_ns)
+        if cached and cached[1] == signature:
+            sha = cached[2]
+        else:
+            h = hashlib.sha256()
+            with open(filepath, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+            sha = h.hexdigest()
+        self._files[filepath] = (now, signature, sha)
+        return sha
+
+    def exists(self, filepath):
+        return self.digest(filepath) is not None
+
+    def lookup(self, filepath):
+        """Cached file_id for the file's current content, if it was uploaded before"""
+        sha = self.digest(filepath)
+        return self._file_ids.get(sha) if sha else None
+
+    def store(self, filepath, file_id):
+        sha = self.digest(filepath)
+        if not sha:
+            return
+        with self._lock:
+            self._file_ids[sha] = file_id
+            self._save()
+
+    def invalidate(self, filepath):
+        sha = self.digest(filepath)
+        with self._lock:
+            if self._file_ids.pop(sha, None):
+                self._save()
+
+    def _save(self):
+        try:
+            atomic_write_json(self.path, self._file_ids)
+        except OSError as e:
+            logger.error(f"Failed to save media cache: {e}")
+
+    def send_photo(self, bot, chat_id, filepath, **kwargs):
+        """Send a local photo, uploading it only if there is no usable cached file_id"""
+        file_id = self.lookup(filepath)
+        if file_id:
+            try:
+                return bot.send_photo(chat_id, file_id, **kwargs)
+            except ApiTelegramException as e:
+                if e.error_code != 400:
+                    raise
+                logger.warning(f"Cached file_id for {filepath} was rejected, re-uploading: {e}")
+                self.invalidate(filepath)
+        with open(filepath, "rb") as photo:
+            sent = bot.send_photo(chat_id, photo, **kwargs)
+        self.store(filepath, sent.photo[-1].file_id)
+        logger.info(f"Uploaded {filepath} and cached its file_id")
+        return sent
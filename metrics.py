@@ -0,0 +1,302 @@
+import time
+import bisect
+import asyncio
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException
+from telebot.handler_backends import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a fast SQLite write to a slow Bot API call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Fixed-bucket latency histogram; observing is a bisect and two additions"""
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate of the ``q`` quantile, interpolated within its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.bounds[i - 1] if i else 0.0
+                if i == len(self.bounds):
+                    return lower
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+class Registry:
+    """Counters, histograms and callback gauges, rendered in Prometheus text format.
+
+    Series are identified by a name plus keyword labels. Gauges are read
+    through a callback only when metrics are rendered, so queue depths and
+    cache sizes cost nothing between scrapes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def gauge(self, name, func, **labels):
+        """Report ``func()`` as the current value of a gauge"""
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = func
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name, **labels):
+        """Decorator recording each call's duration in histogram ``name``"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - started, **labels)
+            return wrapper
+        return decorator
+
+    def _snapshot(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (h.counts[:], h.sum, h.count))
+                                for key, h in self._histograms.items())
+            gauges = sorted(self._gauges.items(), key=lambda item: item[0])
+        values = []
+        for key, func in gauges:
+            try:
+                values.append((key, func()))
+            except Exception as e:
+                logger.warning(f"Gauge {key[0]} failed: {e}")
+        return counters, histograms, values
+
+    def render(self):
+        """All series in the Prometheus text exposition format"""
+        counters, histograms, gauges = self._snapshot()
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, key), value in counters:
+            declare(name, "counter")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), value in gauges:
+            declare(name, "gauge")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), (counts, total, count) in histograms:
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(DEFAULT_BUCKETS + ("+Inf",), counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Compact plain-text dump for the admin /metrics command"""
+        counters, histograms, gauges = self._snapshot()
+        lines = ["Latency (count, p50 / p99 ms):"]
+        for (name, key), (counts, total, count) in histograms:
+            histogram = Histogram()
+            histogram.counts, histogram.count = counts, count
+            lines.append(f"• {name}{_format_labels(key)}: {count}, "
+                         f"{histogram.quantile(0.5) * 1000:.1f} / {histogram.quantile(0.99) * 1000:.1f}")
+        lines.append("")
+        lines.append("Counters:")
+        lines += [f"• {name}{_format_labels(key)}: {value}" for (name, key), value in counters]
+        lines.append("")
+        lines.append("Gauges:")
+        lines += [f"• {name}{_format_labels(key)}: {value}" for (name, key), value in gauges]
+        return "\n".join(lines)
+
+registry = Registry()
+
+def _api_status(error):
+    if isinstance(error, ApiTelegramException):
+        return str(error.error_code)
+    return "error"
+
+def instrument_api():
+    """Time every Bot API call made through apihelper.
+
+    The helper sends all requests through a single module function, so
+    wrapping it covers every TeleBot method. Calls are labelled by API method
+    and by outcome ("ok", the HTTP error code such as 429, or "error" for
+    network failures).
+    """
+    make_request = apihelper._make_request
+    if getattr(make_request, "instrumented", False):
+        return
+
+    @functools.wraps(make_request)
+    def timed_make_request(token, method_name, *args, **kwargs):
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return make_request(token, method_name, *args, **kwargs)
+        except Exception as e:
+            status = _api_status(e)
+            raise
+        finally:
+            registry.observe("telegram_api_seconds", time.perf_counter() - started, method=method_name)
+            registry.inc("telegram_api_requests_total", method=method_name, status=status)
+
+    timed_make_request.instrumented = True
+    apihelper._make_request = timed_make_request
+
+def instrument_async_api():
+    """``instrument_api`` for AsyncTeleBot's asyncio_helper. Kept separate because
+    importing asyncio_helper loads aiohttp, which only the async mode needs."""
+    from telebot import asyncio_helper
+
+    process_request = asyncio_helper._process_request
+    if getattr(process_request, "instrumented", False):
+        return
+
+    @functools.wraps(process_request)
+    async def timed_process_request(token, url, *args, **kwargs):
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await process_request(token, url, *args, **kwargs)
+        except Exception as e:
+            status = _api_status(e)
+            raise
+        finally:
+            registry.observe("telegram_api_seconds", time.perf_counter() - started, method=url)
+            registry.inc("telegram_api_requests_total", method=url, status=status)
+
+    timed_process_request.instrumented = True
+    asyncio_helper._process_request = timed_process_request
+
+def _timed_handler(func):
+    name = func.__name__
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(message, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(message, *args, **kwargs)
+            except Exception:
+                registry.inc("handler_errors_total", handler=name)
+                raise
+            finally:
+                registry.observe("handler_seconds", time.perf_counter() - started, handler=name)
+    else:
+        @functools.wraps(func)
+        def wrapper(message, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(message, *args, **kwargs)
+            except Exception:
+                registry.inc("handler_errors_total", handler=name)
+                raise
+            finally:
+                registry.observe("handler_seconds", time.perf_counter() - started, handler=name)
+    wrapper.instrumented = True
+    return wrapper
+
+def instrument_handlers(bot):
+    """Wrap every registered message handler of ``bot`` to record its latency.
+
+    Call after all handlers are registered. The wrappers keep the original
+    signature (TeleBot inspects it to decide which arguments to pass).
+    """
+    for handler in bot.message_handlers:
+        if not getattr(handler["function"], "instrumented", False):
+            handler["function"] = _timed_handler(handler["function"])
+
+class MetricsMiddleware(BaseMiddleware):
+    """Counts incoming messages by content type; set up before the flood middleware
+    so dropped updates are counted too"""
+
+    def __init__(self):
+        self.update_types = ["message"]
+
+    def pre_process(self, message, data):
+        registry.inc("updates_total", content_type=message.content_type)
+
+    def post_process(self, message, data, exception):
+        pass
+
+def serve(port, host="127.0.0.1"):
+    """Serve GET /metrics on a background thread; returns the server"""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Metrics available at http://{host}:{port}/metrics")
+    return httpd
@@ -0,0 +1,188 @@
+import time
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+
+from metrics import registry
+from storage import open_connection
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS msg_links (
+    message_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    created_at INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS msg_links_created_at ON msg_links (created_at);
+CREATE TABLE IF NOT EXISTS msg_fanout (
+    message_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    created_at INTEGER NOT NULL,
+    PRIMARY KEY (message_id, user_id)
+);
+"""
+
+class MessageLinkIndex:
+    """Forwarded-message -> user index with a bounded hot tier and an on-disk cold tier.
+
+    Every link is written through to SQLite (the cold tier). The most recent
+    ``hot_size`` links are also kept in an in-memory LRU; entries older than
+    ``hot_ttl`` seconds or pushed out by newer ones are evicted from memory
+    only. The cold tier drops links older than ``retention`` seconds and keeps
+    at most ``max_entries`` rows, pruned every ``prune_every`` inserts.
+    ``on_add(links)``, if set, is called with every batch of new
+    (message_id, user_id) links once they are written.
+
+    A message can also stand for several users (``add_fanout``); replies to
+    it go to all of them. Those links live on disk only.
+    """
+
+    def __init__(self, path, hot_size=10000, hot_ttl=24 * 3600,
+                 retention=30 * 24 * 3600, max_entries=1000000, prune_every=1000, on_add=None):
+        self.hot_size = hot_size
+        self.on_add = on_add
+        self.hot_ttl = hot_ttl
+        self.retention = retention
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._hot = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self.hits = 0
+        self.cold_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self._conn = open_connection(path)
+        self._upgrade_schema()
+
+    def _upgrade_schema(self):
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(msg_links)")]
+        if columns and "created_at" not in columns:
+            # Links written before retention existed count as created now
+            with self._conn:
+                self._conn.execute("ALTER TABLE msg_links ADD COLUMN created_at INTEGER NOT NULL DEFAULT 0")
+                self._conn.execute("UPDATE msg_links SET created_at = ?", (int(time.time()),))
+        self._conn.executescript(SCHEMA)
+
+    def _remember(self, message_id, user_id, created_at):
+        """Put a link in the hot tier; caller must hold the lock"""
+        self._hot[message_id] = (user_id, created_at)
+        self._hot.move_to_end(message_id)
+        while len(self._hot) > self.hot_size:
+            self._hot.popitem(last=False)
+            self.evictions += 1
+
+    @registry.timed("storage_seconds", op="link_write")
+    def add(self, message_id, user_id):
+        message_id, user_id = int(message_id), int(user_id)
+        now = int(time.time())
+        with self._lock:
+            with self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO msg_links VALUES (?, ?, ?)",
+                                   (message_id, user_id, now))
+            self._remember(message_id, user_id, now)
+            self._inserts += 1
+            if self._inserts >= self.prune_every:
+                self._prune(now)
+        if self.on_add:
+            self.on_add([(message_id, user_id)])
+
+    @registry.timed("storage_seconds", op="link_write_many")
+    def add_many(self, links):
+        """Write several (message_id, user_id) links in one transaction"""
+        now = int(time.time())
+        rows = [(int(m), int(u), now) for m, u in links]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO msg_links VALUES (?, ?, ?)", rows)
+            for message_id, user_id, _ in rows[-self.hot_size:]:
+                self._remember(message_id, user_id, now)
+            self._inserts += len(rows)
+            if self._inserts >= self.prune_every:
+                self._prune(now)
+        if self.on_add and rows:
+            self.on_add([(message_id, user_id) for message_id, user_id, _ in rows])
+
+    def get(self, message_id):
+        message_id = int(message_id)
+        now = int(time.time())
+        with self._lock:
+            entry = self._hot.get(message_id)
+            if entry is not None:
+                if now - entry[1] <= self.hot_ttl:
+                    self._hot.move_to_end(message_id)
+                    self.hits += 1
+                    return entry[0]
+                del self._hot[message_id]
+                self.evictions += 1
+            with registry.timer("storage_seconds", op="link_cold_read"):
+                row = self._conn.execute("SELECT user_id, created_at FROM msg_links WHERE message_id = ?",
+                                         (message_id,)).fetchone()
+            if row is None or now - row[1] > self.retention:
+                self.misses += 1
+                return None
+            self.cold_hits += 1
+            self._remember(message_id, row[0], now)
+            return row[0]
+
+    @registry.timed("storage_seconds", op="link_write_fanout")
+    def add_fanout(self, message_id, user_ids, key=None):
+        """Link one message to several users.
+
+        ``on_add`` gets the message linked to ``key`` (default: the first
+        user), so a sharded router sends replies to it where these rows are.
+        """
+        now = int(time.time())
+        user_ids = [int(u) for u in user_ids]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO msg_fanout VALUES (?, ?, ?)",
+                                   [(int(message_id), u, now) for u in user_ids])
+        if self.on_add and user_ids:
+            self.on_add([(int(message_id), int(key) if key is not None else user_ids[0])])
+
+    def fanout(self, message_id):
+        """Users linked to a message with ``add_fanout``, oldest first; empty if none"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id FROM msg_fanout WHERE message_id = ? AND created_at >= ? ORDER BY rowid",
+                (int(message_id), int(time.time()) - self.retention)).fetchall()
+        return [row[0] for row in rows]
+
+    def _prune(self, now):
+        """Drop cold links past retention or over the entry cap; caller must hold the lock"""
+        self._inserts = 0
+        try:
+            with self._conn:
+                removed = self._conn.execute("DELETE FROM msg_links WHERE created_at < ?",
+                                             (now - self.retention,)).rowcount
+                removed += self._conn.execute(
+                    "DELETE FROM msg_links WHERE message_id IN ("
+                    "SELECT message_id FROM msg_links ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)).rowcount
+                removed += self._conn.execute("DELETE FROM msg_fanout WHERE created_at < ?",
+                                              (now - self.retention,)).rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Pruning message links failed: {e}")
+            return
+        self.expired += removed
+        if removed:
+            logger.info(f"Pruned {removed} old message links")
+
+    def stats(self):
+        lookups = self.hits + self.cold_hits + self.misses
+        return {
+            "hot_entries": len(self._hot),
+            "hits": self.hits,
+            "cold_hits": self.cold_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.cold_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,335 @@
+import json
+import time
+import heapq
+import random
+import logging
+import threading
+from collections import deque
+
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+
+from broadcast import TokenBucket, retry_after
+from metrics import registry
+from storage import open_connection
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    method TEXT NOT NULL,
+    args TEXT NOT NULL,
+    kwargs TEXT NOT NULL,
+    callback TEXT,
+    context TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    dead INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_dead ON outbox (dead, id);
+"""
+
+RATE = 25
+WORKERS = 4
+MAX_ATTEMPTS = 8
+BASE_DELAY = 1.0
+MAX_DELAY = 300.0
+
+def backoff(attempts, base=BASE_DELAY, cap=MAX_DELAY):
+    """Exponential backoff with jitter: half of the delay is fixed, half random"""
+    delay = min(cap, base * 2 ** attempts)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+# Methods whose first argument is the chat a message comes from. They all
+# send to the admin, so they are ordered per source chat instead: one
+# user's forwards stay in order while different users' go out in parallel.
+SOURCE_ORDERED = {"forward_message", "forward_messages"}
+
+def order_key(method, chat_id, args):
+    """What a job is ordered by: its source chat for forwards, otherwise the
+    chat it is sent to"""
+    if method in SOURCE_ORDERED and args:
+        return ("from", args[0])
+    return chat_id
+
+def is_permanent(error):
+    """Errors that retrying cannot fix: bad requests, blocked bot, deleted chats"""
+    return isinstance(error, ApiTelegramException) and error.error_code != 429 and error.error_code < 500
+
+class Job:
+    __slots__ = ("id", "chat_id", "method", "args", "kwargs", "callback", "context", "attempts", "key")
+
+    def __init__(self, id, chat_id, method, args, kwargs, callback, context, attempts=0):
+        self.id = id
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.context = context
+        self.attempts = attempts
+        self.key = order_key(method, chat_id, args)
+
+class Outbox:
+    """Durable outbound queue: every send is stored in SQLite before it is attempted.
+
+    ``send("forward_message", chat_id, ...)`` calls ``bot.forward_message(chat_id,
+    ...)`` on a worker thread; arguments must be JSON-serializable, and a
+    ``reply_to=message_id`` keyword becomes ``reply_parameters``. Messages to
+    one chat go out strictly in order: a chat's next message waits until the
+    previous one was delivered or dead-lettered. Forwards are ordered by the
+    chat they come from instead (see ``order_key``). Transient failures are retried
+    with exponential backoff and jitter, 429s wait exactly ``retry_after``, and
+    permanent failures (blocked bot, bad request) or ``max_attempts`` failures
+    are kept as dead letters for ``replay``. Pending messages survive restarts.
+
+    Work that depends on the outcome is named by ``callback``, registered with
+    ``register``; its ``on_sent(result, **context)`` or ``on_dead(error,
+    **context)`` runs on the worker thread.
+
+    Job ids start at ``first_id``, so outboxes of different processes can hand
+    out ids that never collide. On shutdown, ``drain`` waits for the queue to
+    empty and ``close`` stops the workers; whatever is still pending then is
+    sent after the next start.
+    """
+
+    def __init__(self, bot, path, rate=RATE, workers=WORKERS, max_attempts=MAX_ATTEMPTS, first_id=1):
+        self.bot = bot
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.bucket = TokenBucket(rate)
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self._callbacks = {}
+        self._queues = {}
+        self._ready = []
+        self._cond = threading.Condition()
+        self._db_lock = threading.Lock()
+        self._threads = []
+        self._started = False
+        self._closing = False
+        self._closed = False
+        self._conn = open_connection(path)
+        self._conn.executescript(SCHEMA)
+        if first_id > 1:
+            # Rows inserted earlier (e.g. by shard.split_state) may have left the
+            # sequence below this outbox's range; only ever raise it
+            with self._conn:
+                row = self._conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'outbox'").fetchone()
+                if row is None:
+                    self._conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('outbox', ?)",
+                                       (first_id - 1,))
+                elif row[0] < first_id - 1:
+                    self._conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'outbox'",
+                                       (first_id - 1,))
+
+    def register(self, name, on_sent=None, on_dead=None):
+        self._callbacks[name] = (on_sent, on_dead)
+
+    def start(self):
+        """Queue messages left pending by the last run and start the workers;
+        register callbacks first"""
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT id, chat_id, method, args, kwargs, callback, context, attempts "
+                "FROM outbox WHERE dead = 0 ORDER BY id").fetchall()
+            # Messages sent from here on are queued by send() itself
+            self._started = True
+        for row in rows:
+            self._enqueue(self._job(row))
+        if rows:
+            logger.info(f"Outbox resumed {len(rows)} pending messages")
+        for _ in range(self.workers):
+            t = threading.Thread(target=self._work, name="outbox", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def send(self, method, chat_id, *args, callback=None, context=None, **kwargs):
+        """Store a bot API call and queue it (or leave it for ``start`` to pick up);
+        returns the job id"""
+        with self._db_lock, self._conn:
+            job_id = self._conn.execute(
+                "INSERT INTO outbox (chat_id, method, args, kwargs, callback, context, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (chat_id, method, json.dumps(args), json.dumps(kwargs), callback,
+                 json.dumps(context or {}), time.time())).lastrowid
+            started = self._started
+        if started:
+            self._enqueue(Job(job_id, chat_id, method, args, kwargs, callback, context or {}))
+        return job_id
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(jobs) for jobs in self._queues.values())
+
+    @staticmethod
+    def _job(row):
+        job_id, chat_id, method, args, kwargs, callback, context, attempts = row
+        return Job(job_id, chat_id, method, json.loads(args), json.loads(kwargs),
+                   callback, json.loads(context or "{}"), attempts)
+
+    def _enqueue(self, job):
+        with self._cond:
+            jobs = self._queues.get(job.key)
+            if jobs:
+                # The chat (or forward source) is already queued or in flight; keep its order
+                jobs.append(job)
+                return
+            self._queues[job.key] = deque([job])
+            heapq.heappush(self._ready, (time.monotonic(), job.id, job.key))
+            self._cond.notify()
+
+    def _next_job(self):
+        """Block until some chat's first message is due and return it"""
+        with self._cond:
+            while True:
+                if self._closing:
+                    return None
+                now = time.monotonic()
+                if self._ready and self._ready[0][0] <= now:
+                    key = heapq.heappop(self._ready)[2]
+                    return self._queues[key][0]
+                self._cond.wait(self._ready[0][0] - now if self._ready else None)
+
+    def _advance(self, job, delay=None):
+        """Drop ``job`` from its chat (or keep it first if ``delay`` is given) and
+        make the chat's next message ready"""
+        with self._cond:
+            jobs = self._queues[job.key]
+            if delay is None:
+                jobs.popleft()
+                delay = 0
+            if not jobs:
+                del self._queues[job.key]
+                return
+            heapq.heappush(self._ready, (time.monotonic() + delay, jobs[0].id, job.key))
+            self._cond.notify()
+
+    def _run_callback(self, job, index, outcome):
+        handlers = self._callbacks.get(job.callback)
+        if not handlers or not handlers[index]:
+            return
+        try:
+            handlers[index](outcome, **job.context)
+        except Exception as e:
+            logger.error(f"Outbox callback {job.callback} failed for job {job.id}: {e}")
+
+    def _store(self, sql, params):
+        """Record a job's outcome, unless close() got there first (the job then
+        stays pending and is sent again after the next start)"""
+        with self._db_lock:
+            if self._closed:
+                return
+            with self._conn:
+                self._conn.execute(sql, params)
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            kwargs = job.kwargs
+            if "reply_to" in kwargs:
+                kwargs = dict(kwargs)
+                kwargs["reply_parameters"] = types.ReplyParameters(kwargs.pop("reply_to"),
+                                                                   allow_sending_without_reply=True)
+            self.bucket.acquire()
+            try:
+                result = getattr(self.bot, job.method)(job.chat_id, *job.args, **kwargs)
+            except Exception as e:
+                self._failed(job, e)
+                continue
+            self._store("DELETE FROM outbox WHERE id = ?", (job.id,))
+            self.sent += 1
+            registry.inc("outbox_sent_total", method=job.method)
+            self._run_callback(job, 0, result)
+            self._advance(job)
+
+    def _failed(self, job, error):
+        if is_permanent(error):
+            self._bury(job, error)
+            return
+        if isinstance(error, ApiTelegramException) and error.error_code == 429:
+            # Not counted as an attempt: Telegram said exactly when to come back
+            delay = retry_after(error)
+            self.bucket.pause(delay)
+        else:
+            job.attempts += 1
+            if job.attempts >= self.max_attempts:
+                self._bury(job, error)
+                return
+            delay = backoff(job.attempts)
+        logger.warning(f"Outbox {job.method} to {job.chat_id} failed, retrying in {delay:.1f}s: {error}")
+        self._store("UPDATE outbox SET attempts = ?, error = ? WHERE id = ?",
+                    (job.attempts, str(error), job.id))
+        self.retried += 1
+        registry.inc("outbox_retries_total", method=job.method)
+        self._advance(job, delay)
+
+    def _bury(self, job, error):
+        logger.error(f"Outbox {job.method} to {job.chat_id} dead-lettered: {error}")
+        self._store("UPDATE outbox SET dead = 1, attempts = ?, error = ? WHERE id = ?",
+                    (job.attempts, str(error), job.id))
+        self.dead += 1
+        registry.inc("outbox_dead_total", method=job.method)
+        self._run_callback(job, 1, error)
+        self._advance(job)
+
+    def dead_letters(self, limit=20):
+        """Most recent dead letters as (id, chat_id, method, attempts, error) rows"""
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT id, chat_id, method, attempts, error FROM outbox WHERE dead = 1 "
+                "ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+
+    def dead_count(self):
+        with self._db_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE dead = 1").fetchone()[0]
+
+    def replay(self, job_id=None):
+        """Queue one dead letter (or all of them) again; returns how many"""
+        query = ("SELECT id, chat_id, method, args, kwargs, callback, context, attempts "
+                 "FROM outbox WHERE dead = 1")
+        params = ()
+        if job_id is not None:
+            query += " AND id = ?"
+            params = (job_id,)
+        with self._db_lock, self._conn:
+            rows = self._conn.execute(query + " ORDER BY id", params).fetchall()
+            self._conn.executemany("UPDATE outbox SET dead = 0, attempts = 0 WHERE id = ?",
+                                   [(row[0],) for row in rows])
+        for row in rows:
+            job = self._job(row)
+            job.attempts = 0
+            self._enqueue(job)
+        return len(rows)
+
+    def drain(self, timeout):
+        """Wait up to ``timeout`` seconds for every queued message to be sent or
+        dead-lettered; returns False if some are still pending"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._queues:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    logger.warning(f"Outbox: {len(self._queues)} chats still have messages pending")
+                    return False
+                self._cond.wait(min(left, 0.05))
+        return True
+
+    def close(self, timeout=5):
+        """Stop the workers, letting calls in flight finish for up to ``timeout``
+        seconds, and close the database"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        with self._db_lock:
+            self._closed = True
+            self._conn.close()
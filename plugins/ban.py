@@ -1,28 +1,27 @@
-import config
-import sqlite3
-import telebot
-bot = telebot.TeleBot(config.TOKEN)
-def blocked(message):
-    try:
-        db = sqlite3.connect("./users.db", check_same_thread=False)
-        sql = db.cursor()
-        if message.from_user.id == config.main_id:
-            #fromm = str(message.from_user.id)
-            #name = message.from_user.first_name
-            sql.execute("SELECT user_id FROM USERS WHERE messageid = ?",(message.reply_to_message.message_id,))
-            db.commit()
-            Lusers = sql.fetchall()
-            for i in Lusers:
-                print(i[0])
-                sql.execute("SELECT user_id FROM blocked WHERE user_id = ?",(i[0],))
-                if sql.fetchone() is None:
-                    bot.send_message(i[0],config.ban)
-                    bot.send_message(message.chat.id, "you blocked " + str(i[0]))
-                    sql.execute("INSERT INTO blocked VALUES (?)",(i[0],))
-                    db.commit()
-        else:
-            bot.send_message(message.chat.id, "you are not admin!")
-        sql.close()
-        db.close()
-    except Exception as ee:
-        print("error in block" + str(ee))
\ No newline at end of file
+import time
+from datetime import datetime
+
+import config
+from blocklist import blocklist, parse_duration
+from services import ADMIN_ID, get_original_user
+def blocked(message, bot):
+    try:
+        if message.from_user.id == ADMIN_ID:
+            # "/ban 12h" bans temporarily, plain "/ban" for good; sent as a reply to a forward
+            args = (message.text or "").split()
+            duration = parse_duration(args[1]) if len(args) > 1 else None
+            user_id = get_original_user(message.reply_to_message.message_id) if message.reply_to_message else None
+            if user_id is None:
+                bot.send_message(message.chat.id, "reply to a forwarded message to ban its sender")
+            elif blocklist.block(user_id, duration):
+                bot.send_message(user_id, config.ban)
+                bot.send_message(message.chat.id, "you blocked " + str(user_id))
+            elif duration:
+                until = datetime.fromtimestamp(time.time() + duration).isoformat(sep=" ", timespec="minutes")
+                bot.send_message(message.chat.id, f"{user_id} was already banned; the ban now ends {until}")
+            else:
+                bot.send_message(message.chat.id, f"{user_id} was already banned; the ban is now permanent")
+        else:
+            bot.send_message(message.chat.id, "you are not admin!")
+    except Exception as ee:
+        print("error in block" + str(ee))
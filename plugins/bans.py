@@ -0,0 +1,37 @@
+import io
+
+import shard
+from blocklist import blocklist, read_bans_csv, write_bans_csv
+from services import ADMIN_ID, SHARD_LABEL
+
+# Import and export go through the running blocklist, so the in-memory set
+# and the expiry timers change together with the table. In sharded mode
+# every shard gets these commands and handles the bans of its own users.
+def export_bans(message, bot):
+    """/exportbans: every ban as a CSV file (user_id,until)"""
+    if message.from_user.id != ADMIN_ID:
+        bot.send_message(message.chat.id, "you are not admin!")
+        return
+    out = io.StringIO()
+    write_bans_csv(out, blocklist.export_bans())
+    bot.send_document(message.chat.id, io.BytesIO(out.getvalue().encode("utf-8")),
+                      visible_file_name=shard.shard_path("bans.csv"), caption=f"{len(blocklist)} bans{SHARD_LABEL}")
+
+def import_bans(message, bot):
+    """/importbans, sent as a reply to a CSV file like the one /exportbans sends"""
+    if message.from_user.id != ADMIN_ID:
+        bot.send_message(message.chat.id, "you are not admin!")
+        return
+    document = message.reply_to_message.document if message.reply_to_message else None
+    if document is None:
+        bot.send_message(message.chat.id, "reply to a CSV file (user_id,until) to import its bans")
+        return
+    data = bot.download_file(bot.get_file(document.file_id).file_path).decode("utf-8-sig")
+    try:
+        rows = [(user_id, until) for user_id, until in read_bans_csv(io.StringIO(data))
+                if shard.shard_of(user_id, shard.SHARD_COUNT) == shard.SHARD]
+        imported = blocklist.import_bans(rows)
+    except (KeyError, ValueError) as e:
+        bot.send_message(message.chat.id, f"could not read {document.file_name}: {e}", parse_mode=None)
+        return
+    bot.send_message(message.chat.id, f"imported {imported} bans{SHARD_LABEL}")
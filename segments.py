@@ -0,0 +1,104 @@
+import time
+import logging
+import threading
+
+import db
+from storage import open_connection, upgrade_schema
+
+logger = logging.getLogger(__name__)
+
+# Filters a segment is built from: name -> (SQL condition, default days or None).
+# Conditions with a day count compare against a "?" cutoff time.
+FILTERS = {
+    "all": ("1", None),
+    "active": ("u.last_seen >= ?", 7),
+    "inactive": ("(u.last_seen IS NULL OR u.last_seen < ?)", 7),
+    "vip": ("v.user_id IS NOT NULL", None),
+    "no_vip": ("v.user_id IS NULL", None),
+    # Saw the VIP offer and never wrote in after it
+    "vip_silent": ("v.user_id IS NOT NULL AND (u.last_seen IS NULL OR u.last_seen <= v.seen_at)", None),
+    "not_blocked": ("b.user_id IS NULL", None),
+    "blocked": ("b.user_id IS NOT NULL", None),
+}
+
+SOURCE = ("FROM users u LEFT JOIN seen_vip v ON v.user_id = u.user_id "
+          "LEFT JOIN blocked b ON b.user_id = u.user_id")
+
+PAGE_SIZE = 1000
+
+def parse(segment):
+    """SQL condition and parameters for a segment such as "active:7,not_blocked".
+
+    A segment is a comma-separated list of filters that must all match;
+    "active" and "inactive" take an optional day count. Raises ValueError
+    for unknown filters.
+    """
+    conditions = []
+    params = []
+    for part in (segment or "all").lower().split(","):
+        name, _, days = part.strip().partition(":")
+        if name not in FILTERS:
+            raise ValueError(f"Unknown segment filter '{name}'")
+        condition, default_days = FILTERS[name]
+        if default_days is None:
+            if days:
+                raise ValueError(f"Segment filter '{name}' takes no day count")
+        else:
+            if days and not days.isdigit():
+                raise ValueError(f"Day count for '{name}' must be a number")
+            params.append(int(time.time()) - int(days or default_days) * 86400)
+        conditions.append(condition)
+    return " AND ".join(conditions), params
+
+def split_target(text):
+    """(segment, rest) for "to:vip_silent,not_blocked rest of text"; the segment
+    is "all" when the text does not start with "to:" """
+    text = (text or "").strip()
+    if not text.startswith("to:"):
+        return "all", text
+    segment, _, rest = text[3:].partition(" ")
+    return segment, rest.strip()
+
+def describe():
+    return ", ".join(f"{name}:days" if days else name for name, (_, days) in FILTERS.items())
+
+class Segments:
+    """Streams the user IDs of a segment from the state database.
+
+    Recipients are read in ascending ID order, ``page_size`` at a time, each
+    page a short query starting after the last ID seen. Memory stays constant
+    however many users match, and no read transaction is held open for the
+    length of a broadcast (which would stop the WAL from being checkpointed).
+    """
+
+    def __init__(self, path, page_size=PAGE_SIZE):
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._conn = open_connection(path)
+        upgrade_schema(self._conn)
+        self._conn.executescript(db.SCHEMA)
+
+    def iter(self, segment="all", after=None):
+        """User IDs in ``segment`` greater than ``after``, ascending"""
+        condition, params = parse(segment)
+        query = f"SELECT u.user_id {SOURCE} WHERE u.user_id > ? AND {condition} ORDER BY u.user_id LIMIT ?"
+        cursor = after if after is not None else -1
+        while True:
+            with self._lock:
+                page = self._conn.execute(query, [cursor] + params + [self.page_size]).fetchall()
+            for (user_id,) in page:
+                yield user_id
+            if len(page) < self.page_size:
+                return
+            cursor = page[-1][0]
+
+    def count(self, segment="all", after=None):
+        """How many users ``iter`` would yield; a dry run of a broadcast"""
+        condition, params = parse(segment)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) {SOURCE} WHERE u.user_id > ? AND {condition}",
+                                      [after if after is not None else -1] + params).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,106 @@
+import os
+import logging
+
+from telebot import TeleBot, apihelper
+
+import metrics
+import shard
+from storage import StateStore
+from msg_index import MessageLinkIndex
+from broadcast import Broadcaster
+from outbox import Outbox
+from segments import Segments
+from stats import StatsAggregator
+
+logger = logging.getLogger(__name__)
+
+# The one bot instance and storage backend shared by main.py and the lazily
+# loaded plugins/ modules. Importing this module does not start anything.
+
+# Security: Use environment variables for sensitive data
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+ADMIN_ID = int(os.getenv('ADMIN_ID', '0'))
+
+# Validate required environment variables
+if not BOT_TOKEN:
+    raise ValueError("BOT_TOKEN environment variable is required!")
+if ADMIN_ID == 0:
+    raise ValueError("ADMIN_ID environment variable is required!")
+
+# In scale-out mode (shard.py) each handler process has its own files
+STATS_FILE = shard.shard_path("stats.json")
+STATE_DB = shard.shard_path(os.getenv("STATE_DB", "bot_state.db"))
+SHARD_LABEL = f" (shard {shard.SHARD + 1}/{shard.SHARD_COUNT})" if shard.SHARD_COUNT > 1 else ""
+
+# A local telegram-bot-api server (or bench/fake_api.py) instead of api.telegram.org
+BOT_API_URL = os.getenv("BOT_API_URL")
+
+# Forward-map sizing: hot in-memory entries, hot TTL and on-disk retention
+MSG_LINK_HOT_SIZE = int(os.getenv("MSG_LINK_HOT_SIZE", "10000"))
+MSG_LINK_HOT_TTL_HOURS = int(os.getenv("MSG_LINK_HOT_TTL_HOURS", "24"))
+MSG_LINK_RETENTION_DAYS = int(os.getenv("MSG_LINK_RETENTION_DAYS", "30"))
+MSG_LINK_MAX_ENTRIES = int(os.getenv("MSG_LINK_MAX_ENTRIES", "1000000"))
+
+# Rates are per bot, not per process: shards split them evenly
+BROADCAST_CHECKPOINT = shard.shard_path("broadcast_checkpoint.json")
+BROADCAST_RATE = max(1, int(os.getenv("BROADCAST_RATE", "25")) // shard.SHARD_COUNT)
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+
+# Durable outbound queue for forwards and admin replies
+OUTBOX_RATE = max(1, int(os.getenv("OUTBOX_RATE", "25")) // shard.SHARD_COUNT)
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+
+# Initialize bot; every API call is timed for /metrics
+if BOT_API_URL:
+    apihelper.API_URL = BOT_API_URL.rstrip("/") + "/bot{0}/{1}"
+metrics.instrument_api()
+bot = TeleBot(BOT_TOKEN, parse_mode="Markdown", use_class_middlewares=True)
+
+stats = StatsAggregator(STATS_FILE)
+
+# Indexed state store; users, seen-VIP, message links, the outbox and bans
+# all live in STATE_DB
+state = StateStore(STATE_DB)
+links = MessageLinkIndex(
+    STATE_DB,
+    hot_size=MSG_LINK_HOT_SIZE,
+    hot_ttl=MSG_LINK_HOT_TTL_HOURS * 3600,
+    retention=MSG_LINK_RETENTION_DAYS * 24 * 3600,
+    max_entries=MSG_LINK_MAX_ENTRIES,
+)
+outbox = Outbox(bot, STATE_DB, rate=OUTBOX_RATE, workers=OUTBOX_WORKERS,
+                first_id=shard.SHARD * shard.OUTBOX_ID_SPAN + 1)
+
+def save_user(user_id):
+    """Save user ID to users list"""
+    if state.add_user(user_id):
+        stats.record("new_user", user_id)
+        logger.info(f"New user saved: {user_id}")
+
+def log_message_link(forwarded_msg_id, user_id):
+    """Link forwarded message ID to original user"""
+    links.add(forwarded_msg_id, user_id)
+    stats.record("forward")
+
+def get_original_user(reply_msg_id):
+    """Get original user ID from forwarded message ID"""
+    return links.get(reply_msg_id)
+
+def record_broadcast(job):
+    """Add a finished broadcast's delivery counts to the stats"""
+    stats.record("broadcasts")
+    stats.record("broadcast_sent", count=job["sent"])
+    stats.record("broadcast_failed", count=job["failed"])
+    stats.record("broadcast_pruned", count=job["pruned"])
+
+# Broadcast recipients are streamed from STATE_DB by segment
+audience = Segments(STATE_DB)
+broadcaster = Broadcaster(
+    bot,
+    audience=audience,
+    checkpoint_path=BROADCAST_CHECKPOINT,
+    prune=state.remove_user,
+    on_finish=record_broadcast,
+    rate=BROADCAST_RATE,
+    workers=BROADCAST_WORKERS,
+)
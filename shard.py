@@ -0,0 +1,398 @@
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+import multiprocessing
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Scale-out mode: one ingress process (poller or webhook) routes every update
+# to one of SHARD_COUNT handler processes. A handler process owns the users
+# with user_id % SHARD_COUNT == SHARD and keeps their state in its own files.
+# Both are set by configure() before main.py is imported; a plain
+# `python main.py` is shard 0 of 1 and uses the unsuffixed file names.
+SHARD = 0
+SHARD_COUNT = 1
+
+# Outbox job ids of shard k start at k * OUTBOX_ID_SPAN, so /replay <id> can
+# be routed to the shard that owns the dead letter
+OUTBOX_ID_SPAN = 10 ** 12
+
+# Admin commands every shard answers for its own users
+FANOUT_COMMANDS = {"broadcast", "everyone", "segment", "stats", "metrics", "outbox", "replay",
+                   "exportbans", "importbans"}
+
+SHARD_MAP_FILE = "shards.json"
+
+def configure(index, count):
+    global SHARD, SHARD_COUNT
+    SHARD, SHARD_COUNT = index, count
+
+def shard_of(user_id, count):
+    return int(user_id) % count
+
+def shard_path(path, index=None, count=None):
+    """``path`` with the shard number before the extension ("bot_state.shard2.db");
+    unchanged when running unsharded"""
+    index = SHARD if index is None else index
+    count = SHARD_COUNT if count is None else count
+    if count <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index}{ext}"
+
+def router_path(path):
+    root, ext = os.path.splitext(path)
+    return f"{root}.router{ext}"
+
+def command_of(text):
+    """The bot command a message starts with ("stats" for "/stats@bot now"), or None"""
+    if not text or not text.startswith("/"):
+        return None
+    return text.split(maxsplit=1)[0][1:].split("@")[0].lower()
+
+def split_state(path, count, router_links):
+    """Split an unsharded state database into ``count`` shard databases, once.
+
+    Users, seen-VIP marks, bans and message links go to the shard of their
+    user; pending outbox jobs go to the shard of the user they concern. Every
+    message link is also copied into ``router_links`` so admin replies to old
+    forwards are routed correctly. The source is renamed to ``path + ".split"``.
+    """
+    import sqlite3
+    import db
+    import storage
+    import msg_index
+    import outbox
+
+    if not os.path.exists(path):
+        return False
+    source = sqlite3.connect(path)
+    try:
+        storage.upgrade_schema(source)
+        tables = {row[0] for row in source.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        jobs = source.execute(
+            "SELECT id, chat_id, method, args, kwargs, callback, context, attempts, created_at, dead, error "
+            "FROM outbox").fetchall() if "outbox" in tables else []
+        links = source.execute("SELECT message_id, user_id FROM msg_links").fetchall() if "msg_links" in tables else []
+    finally:
+        source.close()
+
+    sharded = [("users", "user_id, last_seen", "user_id"), ("seen_vip", "user_id, seen_at", "user_id"),
+               ("blocked", "user_id, until", "user_id"), ("msg_links", "message_id, user_id, created_at", "user_id")]
+    for index in range(count):
+        conn = storage.open_connection(shard_path(path, index, count))
+        conn.executescript(storage.SCHEMA + db.SCHEMA + msg_index.SCHEMA + outbox.SCHEMA)
+        conn.execute("ATTACH DATABASE ? AS src", (path,))
+        with conn:
+            for table, columns, key in sharded:
+                if table in tables:
+                    conn.execute(f"INSERT OR IGNORE INTO {table} ({columns}) SELECT {columns} "
+                                 f"FROM src.{table} WHERE {key} % ? = ?", (count, index))
+            if "meta" in tables:
+                # The state snapshot belongs to the unsplit database
+                conn.execute("INSERT OR IGNORE INTO meta SELECT key, value FROM src.meta WHERE key != ?",
+                             (storage.SNAPSHOT_KEY,))
+            # Any shard can answer a reply to many, so every shard gets them all
+            if "msg_fanout" in tables:
+                conn.execute("INSERT OR IGNORE INTO msg_fanout SELECT message_id, user_id, created_at "
+                             "FROM src.msg_fanout")
+            # Forwards carry their user in the callback context; anything else
+            # concerns the chat it is sent to. Ids move into the shard's range,
+            # so /replay <id> is routed to the shard that holds the job.
+            conn.executemany(
+                "INSERT INTO outbox (id, chat_id, method, args, kwargs, callback, context, attempts, "
+                "created_at, dead, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(index * OUTBOX_ID_SPAN + job[0],) + job[1:] for job in jobs
+                 if shard_of(json.loads(job[6] or "{}").get("user_id", job[1]), count) == index])
+        conn.execute("DETACH DATABASE src")
+        conn.close()
+    router_links.add_many(links)
+    os.replace(path, path + ".split")
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    logger.info(f"Split {path} into {count} shards: {len(links)} message links, {len(jobs)} outbox jobs")
+    return True
+
+def check_shard_count(count):
+    """Refuse to start with a different shard count than the state was split into"""
+    from storage import atomic_write_json, load_json
+
+    saved = load_json(SHARD_MAP_FILE, {}).get("count")
+    if saved is not None and saved != count:
+        raise ValueError(f"State is split into {saved} shards; re-sharding to {count} is not supported")
+    if saved is None:
+        atomic_write_json(SHARD_MAP_FILE, {"count": count})
+
+def worker(index, count, lanes, updates, events, metrics_port, log_level=logging.INFO):
+    """Handler process: runs main.py's handlers for shard ``index``.
+
+    Updates arrive as (key, update dict) pairs. They are spread over ``lanes``
+    threads by ``key`` (the user they concern), so one user's updates are
+    handled in order while different users are handled in parallel.
+    """
+    configure(index, count)
+    import lifecycle
+    # SIGTERM reaches every process of a dyno; the router decides when shards stop
+    lifecycle.ignore_signals()
+    import main
+    from telebot import types
+
+    logging.getLogger().setLevel(log_level)
+    # Tell the router about every new forward, so admin replies come back here
+    main.links.on_add = events.put
+    main.bot.threaded = False
+    main.startup(metrics_port)
+    main.metrics.instrument_handlers(main.bot)
+
+    def run_lane(lane):
+        while True:
+            update = lane.get()
+            if update is None:
+                return
+            try:
+                main.bot.process_new_updates([types.Update.de_json(update)])
+            except Exception as e:
+                logger.error(f"Shard {index}: handler failed for update {update.get('update_id')}: {e}")
+
+    lane_queues = [queue.Queue() for _ in range(lanes)]
+    threads = [threading.Thread(target=run_lane, args=(q,), name=f"shard{index}-lane", daemon=True)
+               for q in lane_queues]
+    for t in threads:
+        t.start()
+    main.metrics.registry.gauge("handler_queue_depth", lambda: sum(q.qsize() for q in lane_queues))
+    logger.info(f"Shard {index + 1}/{count} ready with {lanes} lanes")
+    router_pid = os.getppid()
+    try:
+        while True:
+            try:
+                item = updates.get(timeout=1)
+            except queue.Empty:
+                if os.getppid() != router_pid:
+                    logger.warning(f"Shard {index}: the router is gone; shutting down")
+                    break
+                continue
+            if item is None:
+                break
+            key, update = item
+            lane_queues[(key // count) % lanes].put(update)
+    finally:
+        for q in lane_queues:
+            q.put(None)
+        for t in threads:
+            t.join(lifecycle.remaining())
+        main.shutdown()
+
+class Router:
+    """Ingress side of scale-out mode: starts the handler processes and routes updates.
+
+    A user's messages always go to the shard of their user id. Admin replies
+    go to the shard that forwarded the replied-to message (workers report every
+    forward back over ``events``, kept in a message link index here), album
+    items follow the first item of their album, and admin-wide commands such
+    as /stats and /broadcast go to every shard. Only message updates are
+    routed; the bot has no handlers for anything else.
+
+    Has TeleBot's ``process_new_updates``, so it can stand in for the bot in
+    webhook.WebhookServer.
+    """
+
+    def __init__(self, admin_id, links, count, lanes=4, metrics_port=0, group_memory=1000):
+        self.admin_id = admin_id
+        self.links = links
+        self.count = count
+        self.lanes = lanes
+        self.metrics_port = metrics_port
+        self.group_memory = group_memory
+        self.threaded = False
+        self.routed = [0] * count
+        self.unrouted = 0
+        self._groups = OrderedDict()
+        self._groups_lock = threading.Lock()
+        context = multiprocessing.get_context("spawn")
+        self.queues = [context.Queue() for _ in range(count)]
+        self.events = context.Queue()
+        self.processes = [
+            context.Process(target=worker, name=f"shard{i}",
+                            args=(i, count, lanes, self.queues[i], self.events,
+                                  metrics_port + 1 + i if metrics_port else 0,
+                                  logging.getLogger().getEffectiveLevel()))
+            for i in range(count)
+        ]
+        self._collector = threading.Thread(target=self._collect_links, name="shard-links", daemon=True)
+
+    def start(self):
+        self._collector.start()
+        for process in self.processes:
+            process.start()
+        logger.info(f"Started {self.count} shard processes")
+
+    def stop(self, timeout=30):
+        """Let every shard drain its queue and shut down, then stop collecting links"""
+        for q in self.queues:
+            q.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                # Shards ignore SIGTERM, so terminate() would not stop them
+                logger.warning(f"{process.name} did not stop in {timeout:.0f}s; killing it")
+                process.kill()
+        self.events.put(None)
+        self._collector.join(timeout)
+
+    def _collect_links(self):
+        while True:
+            links = self.events.get()
+            if links is None:
+                return
+            try:
+                self.links.add_many(links)
+            except Exception as e:
+                logger.error(f"Recording {len(links)} routed links failed: {e}")
+
+    def route(self, message):
+        """(shard, key) for a message dict, or (None, key) to send it to every shard"""
+        user_id = message.get("from", {}).get("id", 0)
+        group = message.get("media_group_id")
+        if group:
+            with self._groups_lock:
+                if group in self._groups:
+                    return self._groups[group]
+        key = user_id
+        if user_id == self.admin_id:
+            command = command_of(message.get("text"))
+            reply = message.get("reply_to_message")
+            if command in FANOUT_COMMANDS:
+                arg = message["text"].split(maxsplit=1)[1:]
+                if command == "replay" and arg and arg[0].strip().isdigit():
+                    shard = int(arg[0]) // OUTBOX_ID_SPAN
+                    return (shard if shard < self.count else 0), key
+                return None, key
+            if reply:
+                key = self.links.get(reply["message_id"]) or user_id
+        shard = shard_of(key, self.count)
+        if group:
+            with self._groups_lock:
+                self._groups[group] = (shard, key)
+                while len(self._groups) > self.group_memory:
+                    self._groups.popitem(last=False)
+        return shard, key
+
+    def process_new_updates(self, updates):
+        """Route parsed updates (from TeleBot.get_updates or the webhook server)"""
+        for update in updates:
+            if update.message is None:
+                self.unrouted += 1
+                continue
+            self.dispatch({"update_id": update.update_id, "message": update.message.json})
+
+    def dispatch(self, update):
+        """Route one raw update dict"""
+        shard, key = self.route(update["message"])
+        targets = range(self.count) if shard is None else (shard,)
+        for index in targets:
+            self.queues[index].put((key, update))
+            self.routed[index] += 1
+
+    def queued(self):
+        return sum(q.qsize() for q in self.queues)
+
+def poll(bot, router, timeout=20):
+    """Long-poll getUpdates and route each batch until interrupted"""
+    offset = None
+    while True:
+        try:
+            updates = bot.get_updates(offset=offset, timeout=timeout, long_polling_timeout=timeout)
+        except Exception as e:
+            logger.error(f"getUpdates failed: {e}")
+            time.sleep(3)
+            continue
+        if updates:
+            offset = updates[-1].update_id + 1
+            router.process_new_updates(updates)
+
+def run(count, lanes=4, mode="polling"):
+    """Run the ingress and ``count`` handler processes until interrupted"""
+    from telebot import TeleBot, apihelper
+
+    import lifecycle
+    import metrics
+    import webhook
+    from msg_index import MessageLinkIndex
+
+    token = os.getenv("BOT_TOKEN")
+    admin_id = int(os.getenv("ADMIN_ID", "0"))
+    if not token or not admin_id:
+        raise ValueError("BOT_TOKEN and ADMIN_ID environment variables are required!")
+    if mode == "webhook":
+        webhook.check_secret(os.getenv("WEBHOOK_SECRET"))
+    if os.getenv("BOT_API_URL"):
+        apihelper.API_URL = os.getenv("BOT_API_URL").rstrip("/") + "/bot{0}/{1}"
+    state_db = os.getenv("STATE_DB", "bot_state.db")
+    metrics_port = int(os.getenv("METRICS_PORT", "9100"))
+
+    check_shard_count(count)
+    links = MessageLinkIndex(router_path(state_db))
+    if not os.path.exists(shard_path(state_db, 0, count)):
+        split_state(state_db, count, links)
+    elif os.path.exists(state_db):
+        logger.warning(f"Ignoring {state_db}: the state is already split into {count} shards")
+    for legacy in ("users.json", "users.db"):
+        if os.path.exists(legacy):
+            logger.warning(f"{legacy} is only migrated in single-process mode; start once without shards")
+    # The stats history so far stays with shard 0
+    if os.path.exists("stats.json") and not os.path.exists(shard_path("stats.json", 0, count)):
+        os.replace("stats.json", shard_path("stats.json", 0, count))
+
+    metrics.instrument_api()
+    bot = TeleBot(token)
+    router = Router(admin_id, links, count, lanes=lanes, metrics_port=metrics_port)
+    for index, q in enumerate(router.queues):
+        metrics.registry.gauge("shard_queue_depth", q.qsize, shard=index)
+        metrics.registry.gauge("shard_updates_routed", lambda index=index: router.routed[index], shard=index)
+    if metrics_port:
+        metrics.serve(metrics_port, os.getenv("METRICS_HOST", "127.0.0.1"))
+    lifecycle.handle_signals()
+    router.start()
+    logger.info(f"Routing updates to {count} shards in {mode} mode")
+    try:
+        if mode == "webhook":
+            webhook.run(bot, int(os.getenv("PORT", "8080")), os.getenv("WEBHOOK_PATH", "/webhook"),
+                        os.getenv("WEBHOOK_SECRET"), os.getenv("WEBHOOK_URL"),
+                        workers=int(os.getenv("WEBHOOK_WORKERS", "8")),
+                        queue_size=int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000")), handler=router)
+        else:
+            bot.remove_webhook()
+            poll(bot, router)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Shards start their own shutdown clock when their queue ends, a moment
+        # after ours; the extra seconds let them write their final snapshots
+        router.stop(lifecycle.remaining() + 3)
+        links.close()
+
+def main(argv=None):
+    """Scale-out mode: one ingress process and N handler processes with sharded state"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--shards", type=int, default=int(os.getenv("SHARDS", "2")))
+    parser.add_argument("--lanes", type=int, default=int(os.getenv("SHARD_LANES", "4")),
+                        help="handler threads per shard")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default=os.getenv("BOT_MODE", "polling"))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    run(args.shards, lanes=args.lanes, mode=args.mode)
+
+if __name__ == "__main__":
+    # Run as the "shard" module: shard processes are spawned with worker()
+    # from it, and configure() must set the globals services.py reads
+    import shard
+    sys.exit(shard.main())
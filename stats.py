@@ -0,0 +1,158 @@
+import time
+import logging
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+
+from storage import atomic_write_json, load_json
+
+logger = logging.getLogger(__name__)
+
+class StatsAggregator:
+    """Event counters kept up to date as things happen, bucketed per day.
+
+    Daily and weekly active users are counted without scanning anything:
+    each user's last active day is remembered, and ``last_seen_counts`` tracks
+    how many users were last seen on each day, so a window's active users is
+    a sum over at most seven buckets. State is snapshotted to ``path`` every
+    ``snapshot_interval`` seconds and restored from it on start.
+
+    ``close`` writes a final snapshot marked clean. After any other shutdown
+    ``saved_at`` is the time of the last snapshot, and ``replay`` recounts the
+    messages the activity log recorded since.
+    """
+
+    def __init__(self, path="stats.json", snapshot_interval=60, retention_days=35):
+        self.path = path
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = threading.Event()
+        saved = load_json(path, {})
+        self.totals = defaultdict(int, saved.get("totals", {}))
+        self.daily = defaultdict(lambda: defaultdict(int))
+        for day, counts in saved.get("daily", {}).items():
+            self.daily[day].update(counts)
+        self.last_active = {}
+        self.last_seen_counts = defaultdict(int)
+        for day, users in saved.get("last_active_by_day", {}).items():
+            self.last_active.update(dict.fromkeys(users, day))
+            self.last_seen_counts[day] += len(users)
+        # Snapshots written before last_active_by_day
+        for user_id, day in saved.get("last_active", {}).items():
+            self.last_active[int(user_id)] = day
+            self.last_seen_counts[day] += 1
+        self.saved_at = None if saved.get("clean", True) else saved.get("saved_at")
+        self._dirty = False
+        self._thread = threading.Thread(target=self._snapshot_loop, args=(snapshot_interval,),
+                                        name="stats-snapshot", daemon=True)
+        self._thread.start()
+
+    def record(self, event, user_id=None, count=1):
+        """Count an event for today; ``user_id`` also marks that user active today"""
+        with self._lock:
+            self._count(event, date.today().isoformat(), user_id, count)
+
+    def _count(self, event, day, user_id=None, count=1):
+        """Count an event for ``day``; caller must hold the lock"""
+        self.totals[event] += count
+        self.daily[day][event] += count
+        if user_id is not None:
+            previous = self.last_active.get(user_id)
+            if previous is None or previous < day:
+                if previous is not None:
+                    self.last_seen_counts[previous] -= 1
+                self.last_seen_counts[day] += 1
+                self.last_active[user_id] = day
+        self._dirty = True
+
+    def replay(self, entries):
+        """Count activity log ``entries`` as the messages they record; returns how many.
+
+        Meant for the log tail after ``saved_at``, which an unclean shutdown
+        left out of the snapshot.
+        """
+        replayed = 0
+        with self._lock:
+            for entry in entries:
+                day = date.fromtimestamp(entry["ts"]).isoformat()
+                self._count("messages", day, entry["user_id"])
+                self._count(f"message_{entry['type']}", day)
+                replayed += 1
+        self.saved_at = None
+        return replayed
+
+    def _window(self, days):
+        today = date.today()
+        return [(today - timedelta(days=i)).isoformat() for i in range(days)]
+
+    def count(self, event, days=1):
+        """Occurrences of ``event`` over the last ``days`` days, today included"""
+        with self._lock:
+            return sum(self.daily[d].get(event, 0) for d in self._window(days) if d in self.daily)
+
+    def active_users(self, days=1):
+        with self._lock:
+            return sum(self.last_seen_counts.get(d, 0) for d in self._window(days))
+
+    def report(self):
+        """Figures for /stats: today, yesterday and the last seven days"""
+        def window(days, offset=0):
+            names = self._window(days + offset)[offset:]
+            with self._lock:
+                counts = defaultdict(int)
+                for d in names:
+                    for event, n in self.daily.get(d, {}).items():
+                        counts[event] += n
+            return counts
+
+        today, yesterday, week = window(1), window(1, offset=1), window(7)
+        delivered = week["broadcast_sent"]
+        attempted = delivered + week["broadcast_failed"] + week["broadcast_pruned"]
+        return {
+            "today": today,
+            "yesterday": yesterday,
+            "week": week,
+            "dau": self.active_users(1),
+            "wau": self.active_users(7),
+            "vip_conversion": week["vip_offer"] / week["new_user"] if week["new_user"] else 0.0,
+            "broadcast_delivery": delivered / attempted if attempted else 0.0,
+        }
+
+    def snapshot(self, final=False):
+        """Write counters to disk atomically and drop days past retention"""
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty and not final:
+                    return
+                cutoff = (date.today() - timedelta(days=self.retention_days)).isoformat()
+                for day in [d for d in self.daily if d < cutoff]:
+                    del self.daily[day]
+                for day in [d for d in self.last_seen_counts if d < cutoff]:
+                    del self.last_seen_counts[day]
+                self.last_active = {u: d for u, d in self.last_active.items() if d >= cutoff}
+                # Grouped by day: lists of ints load several times faster than a dict
+                by_day = defaultdict(list)
+                for user_id, day in self.last_active.items():
+                    by_day[day].append(user_id)
+                data = {
+                    "totals": dict(self.totals),
+                    "daily": {d: dict(c) for d, c in self.daily.items()},
+                    "last_active_by_day": by_day,
+                    "saved_at": time.time(),
+                    "clean": final,
+                }
+                self._dirty = False
+            try:
+                atomic_write_json(self.path, data)
+            except OSError as e:
+                logger.error(f"Failed to write stats snapshot: {e}")
+
+    def close(self):
+        """Stop the snapshot thread and write the final, clean snapshot"""
+        self._closed.set()
+        self.snapshot(final=True)
+
+    def _snapshot_loop(self, interval):
+        while not self._closed.wait(interval):
+            self.snapshot()
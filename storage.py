@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import array
+import secrets
+import sqlite3
+import threading
+import logging
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# last_seen and seen_at are unix times, used by broadcast segments (segments.py)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, last_seen INTEGER);
+CREATE TABLE IF NOT EXISTS seen_vip (user_id INTEGER PRIMARY KEY, seen_at INTEGER);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# meta key holding the token of the state snapshot the database still matches
+SNAPSHOT_KEY = "state_snapshot"
+
+# Columns added after the first release: (table, column, type)
+ADDED_COLUMNS = [("users", "last_seen", "INTEGER"), ("seen_vip", "seen_at", "INTEGER")]
+
+def upgrade_schema(conn):
+    """Create the state tables, adding columns missing from older databases"""
+    conn.executescript(SCHEMA)
+    for table, column, kind in ADDED_COLUMNS:
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            with conn:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+
+def open_connection(path):
+    """Open a SQLite connection tuned for many small writes"""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def load_json(filepath, default_value):
+    """Read a JSON file, falling back to ``default_value`` if it is missing or corrupt"""
+    try:
+        with open(filepath, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default_value
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Could not read {filepath}: {e}")
+        return default_value
+
+@registry.timed("storage_seconds", op="json_write")
+def atomic_write_json(filepath, data):
+    """Write JSON to a temp file and rename it over the target"""
+    tmp_path = filepath + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+
+def atomic_write_bytes(filepath, data):
+    """Binary counterpart of ``atomic_write_json``"""
+    tmp_path = filepath + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+
+class StateStore:
+    """User and seen-VIP state held in memory and persisted to SQLite.
+
+    Lookups never touch disk: the sets are loaded once at startup and every
+    mutation is written through to a WAL-mode database. The
+    WAL is checkpointed (compacted back into the main file) every
+    ``compact_every`` writes. ``touch`` records when a user last wrote in,
+    at most once per ``touch_interval`` seconds per user.
+
+    ``close`` also dumps both sets to ``snapshot_path`` as packed integers, and
+    the next start loads that instead of querying every row. The snapshot
+    carries a token that is stored in the database too; the first write that
+    changes a set deletes the database's copy in the same transaction, so a
+    snapshot is only trusted while nothing has changed since it was written.
+    """
+
+    def __init__(self, path, compact_every=1000, touch_interval=3600, snapshot_path=None):
+        self.path = path
+        self.snapshot_path = snapshot_path or path + ".snapshot"
+        self.compact_every = compact_every
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._touched = {}
+        self._conn = open_connection(path)
+        upgrade_schema(self._conn)
+        self.users = set()
+        self.seen_vip = set()
+        self._snapshot_token = None
+        self._load()
+
+    def _load(self):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (SNAPSHOT_KEY,)).fetchone()
+        self._snapshot_token = row[0] if row else None
+        if self._snapshot_token and self._load_snapshot(self._snapshot_token):
+            logger.info(f"Loaded state snapshot: {len(self.users)} users, {len(self.seen_vip)} seen VIP")
+            return
+        self.users = {row[0] for row in self._conn.execute("SELECT user_id FROM users")}
+        self.seen_vip = {row[0] for row in self._conn.execute("SELECT user_id FROM seen_vip")}
+        logger.info(f"Loaded state: {len(self.users)} users, {len(self.seen_vip)} seen VIP")
+
+    def _load_snapshot(self, token):
+        """Fill the sets from the snapshot file if it is the one ``token`` names"""
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                header = json.loads(f.readline())
+                if header.get("token") != token:
+                    return False
+                users = array.array("q")
+                users.fromfile(f, header["users"])
+                seen_vip = array.array("q")
+                seen_vip.fromfile(f, header["seen_vip"])
+        except FileNotFoundError:
+            return False
+        except (ValueError, KeyError, EOFError, OSError) as e:
+            logger.warning(f"Ignoring unreadable state snapshot {self.snapshot_path}: {e}")
+            return False
+        self.users = set(users)
+        self.seen_vip = set(seen_vip)
+        return True
+
+    @registry.timed("storage_seconds", op="state_snapshot")
+    def snapshot(self):
+        """Write both sets to the snapshot file and mark the database as matching it"""
+        with self._lock:
+            token = secrets.token_hex(8)
+            users = array.array("q", self.users)
+            seen_vip = array.array("q", self.seen_vip)
+            header = json.dumps({"token": token, "users": len(users), "seen_vip": len(seen_vip),
+                                 "saved_at": time.time()})
+            try:
+                atomic_write_bytes(self.snapshot_path,
+                                   header.encode() + b"\n" + users.tobytes() + seen_vip.tobytes())
+            except OSError as e:
+                logger.error(f"Failed to write state snapshot: {e}")
+                return False
+            with self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                   (SNAPSHOT_KEY, token))
+            self._snapshot_token = token
+        return True
+
+    @registry.timed("storage_seconds", op="state_write")
+    def _write(self, sql, params, changes_sets=True):
+        """Run one write statement; caller must hold the lock"""
+        with self._conn:
+            if changes_sets and self._snapshot_token:
+                self._conn.execute("DELETE FROM meta WHERE key = ?", (SNAPSHOT_KEY,))
+                self._snapshot_token = None
+            self._conn.execute(sql, params)
+        self._writes += 1
+        if self._writes >= self.compact_every:
+            self._compact()
+
+    def _compact(self):
+        try:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            logger.error(f"WAL checkpoint failed for {self.path}: {e}")
+        self._writes = 0
+
+    def migrate_json(self, users_file, seen_vip_file, msg_map_file, links):
+        """Import the old JSON files once, on the first start against a new database.
+
+        Forward-map entries go into ``links``, the message link index.
+        """
+        with self._lock:
+            done = self._conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+            if done:
+                return False
+            users = load_json(users_file, [])
+            seen_vip = load_json(seen_vip_file, [])
+            msg_map = load_json(msg_map_file, {})
+            links.add_many((int(k), int(v)) for k, v in msg_map.items())
+            with self._conn:
+                self._conn.execute("DELETE FROM meta WHERE key = ?", (SNAPSHOT_KEY,))
+                self._conn.executemany("INSERT OR IGNORE INTO users (user_id) VALUES (?)",
+                                       [(int(u),) for u in users])
+                self._conn.executemany("INSERT OR IGNORE INTO seen_vip (user_id) VALUES (?)",
+                                       [(int(u),) for u in seen_vip])
+                self._conn.execute("INSERT INTO meta VALUES ('json_migrated', '1')")
+            self._load()
+            self._compact()
+        if users or seen_vip or msg_map:
+            logger.info(f"Migrated {len(users)} users, {len(seen_vip)} seen VIP and "
+                        f"{len(msg_map)} message links from JSON")
+        return True
+
+    def add_user(self, user_id):
+        """Add a user; returns True if they were not known before"""
+        user_id = int(user_id)
+        if user_id in self.users:
+            return False
+        with self._lock:
+            if user_id in self.users:
+                return False
+            self._write("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+            self.users.add(user_id)
+        return True
+
+    def remove_user(self, user_id):
+        user_id = int(user_id)
+        with self._lock:
+            if user_id not in self.users:
+                return False
+            self._write("DELETE FROM users WHERE user_id = ?", (user_id,))
+            self.users.discard(user_id)
+        return True
+
+    def touch(self, user_id):
+        """Record that a user wrote in just now"""
+        user_id = int(user_id)
+        now = int(time.time())
+        if now - self._touched.get(user_id, 0) < self.touch_interval:
+            return
+        with self._lock:
+            self._write("UPDATE users SET last_seen = ? WHERE user_id = ?", (now, user_id), changes_sets=False)
+            self._touched[user_id] = now
+
+    def user_count(self):
+        return len(self.users)
+
+    def has_seen_vip(self, user_id):
+        return int(user_id) in self.seen_vip
+
+    def mark_seen_vip(self, user_id):
+        """Record that a user saw the VIP offer; returns True if this is the first time"""
+        user_id = int(user_id)
+        if user_id in self.seen_vip:
+            return False
+        with self._lock:
+            if user_id in self.seen_vip:
+                return False
+            self._write("INSERT OR IGNORE INTO seen_vip (user_id, seen_at) VALUES (?, ?)",
+                        (user_id, int(time.time())))
+            self.seen_vip.add(user_id)
+            # The next message must update last_seen, or the user would look
+            # silent since the offer ("vip_silent") for up to touch_interval
+            self._touched.pop(user_id, None)
+        return True
+
+    def seen_vip_count(self):
+        return len(self.seen_vip)
+
+    def close(self):
+        self.snapshot()
+        with self._lock:
+            self._compact()
+            self._conn.close()
@@ -0,0 +1,162 @@
+import os
+import re
+import sys
+import time
+import json
+import logging
+import argparse
+import threading
+import unicodedata
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ("offer", "reply", "forward")
+
+DEFAULT_RULES = [
+    {"name": "vip", "keywords": ["magkano", "vip", "pano bumili", "buy vip", "price", "presyo"], "action": "offer"},
+]
+
+Rule = namedtuple("Rule", "name keywords action reply")
+
+def normalize(text):
+    """Fold case and Unicode compatibility forms so 'ＶＩＰ' and 'vip' match alike"""
+    return unicodedata.normalize("NFKC", text).casefold()
+
+def message_text(message):
+    """Text or caption of a message; None for stickers, voice notes and the like"""
+    return getattr(message, "text", None) or getattr(message, "caption", None)
+
+def parse_rules(config):
+    rules = []
+    for index, entry in enumerate(config):
+        action = entry.get("action", "offer")
+        if action not in ACTIONS:
+            raise ValueError(f"rule {index}: unknown action {action!r}")
+        keywords = [normalize(k) for k in entry.get("keywords", []) if k.strip()]
+        if not keywords:
+            raise ValueError(f"rule {index}: no keywords")
+        if action == "reply" and not entry.get("reply"):
+            raise ValueError(f"rule {index}: reply action needs a 'reply' text")
+        rules.append(Rule(entry.get("name", f"rule{index}"), keywords, action, entry.get("reply")))
+    return rules
+
+def compile_rules(rules):
+    """Compile all rules into one alternation with a named group per rule"""
+    parts = []
+    for index, rule in enumerate(rules):
+        # Longest keywords first so 'buy vip' wins over 'vip' at the same position
+        alternatives = "|".join(re.escape(k) for k in sorted(rule.keywords, key=len, reverse=True))
+        parts.append(f"(?P<r{index}>{alternatives})")
+    return re.compile("|".join(parts))
+
+class TriggerEngine:
+    """Keyword/phrase trigger rules matched with a single compiled regex.
+
+    Rules are read from a JSON file (``{"rules": [...]}``) and reloaded when it
+    changes on disk, checked at most every ``check_interval`` seconds. When
+    several rules match, the one listed first wins.
+    """
+
+    def __init__(self, path="triggers.json", check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._mtime = None
+        self._load(parse_rules(DEFAULT_RULES))
+        self.reload()
+
+    def _load(self, rules):
+        # One assignment, so a concurrent match never pairs new rules with the old pattern
+        self._compiled = (rules, compile_rules(rules))
+
+    @property
+    def rules(self):
+        return self._compiled[0]
+
+    def reload(self):
+        """Re-read the rules file; keeps the current rules if it is missing or invalid"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                rules = parse_rules(json.load(f)["rules"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Keeping previous trigger rules, {self.path} is invalid: {e}")
+            return False
+        self._load(rules)
+        logger.info(f"Loaded {len(rules)} trigger rules from {self.path}")
+        return True
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            self.reload()
+
+    def match_text(self, text):
+        """Return the first-listed rule matching ``text``, or None"""
+        if not text:
+            return None
+        self._maybe_reload()
+        rules, pattern = self._compiled
+        best = None
+        for m in pattern.finditer(normalize(text)):
+            index = int(m.lastgroup[1:])
+            if best is None or index < best:
+                best = index
+                if best == 0:
+                    break
+        return rules[best] if best is not None else None
+
+    def match(self, message):
+        return self.match_text(message_text(message))
+
+def benchmark(engine, count=100000):
+    """Time compiled matching against the old per-keyword substring scan"""
+    samples = ["hello po", "magkano po yung vip?", "📷", "Pano bumili ng full set",
+               "good morning! " * 20, "ＰＲＩＣＥ list please", None]
+    keywords = [k for rule in engine.rules for k in rule.keywords]
+    texts = [samples[i % len(samples)] for i in range(count)]
+
+    start = time.perf_counter()
+    for text in texts:
+        engine.match_text(text)
+    compiled = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for text in texts:
+        if text:
+            any(word in text.lower() for word in keywords)
+    naive = time.perf_counter() - start
+
+    print(f"{count} messages, {len(keywords)} keywords in {len(engine.rules)} rules")
+    print(f"compiled regex: {compiled / count * 1e6:.2f} us/message")
+    print(f"substring scan: {naive / count * 1e6:.2f} us/message")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trigger rule tools")
+    parser.add_argument("--rules", default="triggers.json")
+    parser.add_argument("--bench", type=int, metavar="N", help="benchmark matching N messages")
+    parser.add_argument("text", nargs="?", help="show which rule a text triggers")
+    args = parser.parse_args(argv)
+
+    engine = TriggerEngine(args.rules)
+    if args.bench:
+        benchmark(engine, args.bench)
+    if args.text is not None:
+        rule = engine.match_text(args.text)
+        print(rule.name + " -> " + rule.action if rule else "no match")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+import re
+import sys
+import hmac
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+import lifecycle
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Characters Telegram allows in a webhook secret token
+SECRET_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,256}")
+MAX_BODY_SIZE = 1024 * 1024
+
+def check_secret(secret_token):
+    """Raise ValueError unless ``secret_token`` is usable. Webhook mode never runs
+    without one: anyone who can reach the port could post updates as the admin."""
+    if not secret_token:
+        raise ValueError("WEBHOOK_SECRET environment variable is required in webhook mode!")
+    if not SECRET_PATTERN.fullmatch(secret_token):
+        raise ValueError("WEBHOOK_SECRET may only contain A-Z, a-z, 0-9, _ and - (1-256 characters)")
+
+class WebhookServer:
+    """HTTP endpoint that accepts Telegram updates and hands them to a worker pool.
+
+    Requests are answered as soon as the update is validated and queued. When
+    the bounded queue is full the server replies 503, so Telegram backs off and
+    redelivers later instead of the process buffering without limit. Requests
+    without the right secret token header are refused with 403.
+    """
+
+    def __init__(self, bot, host="0.0.0.0", port=8080, path="/webhook",
+                 secret_token=None, workers=8, queue_size=1000):
+        check_secret(secret_token)
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+        self.updates = queue.Queue(maxsize=queue_size)
+        self.accepted = 0
+        self.rejected = 0
+        self._threads = []
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _reply(self, status, body=b""):
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/healthz":
+                    self._reply(200, f"queued={server.updates.qsize()}".encode())
+                else:
+                    self._reply(404)
+
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                if not hmac.compare_digest(
+                        self.headers.get(SECRET_HEADER, ""), server.secret_token):
+                    self._reply(403)
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > MAX_BODY_SIZE:
+                    self._reply(400)
+                    return
+                try:
+                    update = types.Update.de_json(self.rfile.read(length).decode("utf-8"))
+                except Exception as e:
+                    logger.warning(f"Rejected malformed update: {e}")
+                    self._reply(400)
+                    return
+                try:
+                    server.updates.put_nowait(update)
+                except queue.Full:
+                    server.rejected += 1
+                    self._reply(503)
+                    return
+                server.accepted += 1
+                self._reply(200)
+
+        return Handler
+
+    def _work(self):
+        while True:
+            update = self.updates.get()
+            if update is None:
+                return
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                logger.error(f"Handler failed for update {update.update_id}: {e}")
+
+    def start(self):
+        """Start the worker pool and serve HTTP in a background thread"""
+        # Handlers run on our bounded pool, not on TeleBot's own unbounded one
+        self.bot.threaded = False
+        for _ in range(self.workers):
+            t = threading.Thread(target=self._work, name="webhook-worker", daemon=True)
+            t.start()
+            self._threads.append(t)
+        threading.Thread(target=self.httpd.serve_forever, name="webhook-http", daemon=True).start()
+        host, port = self.httpd.server_address[:2]
+        logger.info(f"Webhook server listening on {host}:{port}{self.path}")
+
+    def stop(self, timeout=None):
+        """Stop accepting updates and let the workers handle the ones already
+        queued; returns False if they did not finish within ``timeout`` seconds"""
+        self.httpd.shutdown()
+        for _ in self._threads:
+            self.updates.put(None)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for t in self._threads:
+            t.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        drained = not any(t.is_alive() for t in self._threads)
+        if not drained:
+            logger.warning(f"Webhook: {self.updates.qsize()} updates left unhandled at shutdown")
+        return drained
+
+def run(bot, port, path, secret_token, public_url=None, workers=8, queue_size=1000, handler=None):
+    """Serve webhooks until interrupted; registers the webhook if ``public_url`` is set.
+
+    Updates go to ``handler.process_new_updates`` (by default the bot's own).
+    """
+    server = WebhookServer(handler or bot, port=port, path=path, secret_token=secret_token,
+                           workers=workers, queue_size=queue_size)
+    metrics.instrument_handlers(bot)
+    metrics.registry.gauge("handler_queue_depth", server.updates.qsize)
+    metrics.registry.gauge("webhook_updates_accepted", lambda: server.accepted)
+    metrics.registry.gauge("webhook_updates_rejected", lambda: server.rejected)
+    if public_url:
+        bot.remove_webhook()
+        bot.set_webhook(url=public_url.rstrip("/") + path, secret_token=secret_token)
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop(lifecycle.remaining())
+
+def synthetic_update(update_id, user_id, text, reply_to=None):
+    """Build a minimal private-chat text update, as Telegram would send it"""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    if reply_to is not None:
+        message["reply_to_message"] = {
+            "message_id": reply_to,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+        }
+    return {"update_id": update_id, "message": message}
+
+def post_update(url, update, secret_token=None):
+    """POST one update to a webhook server; returns the HTTP status"""
+    request = urllib.request.Request(url, data=json.dumps(update).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    if secret_token:
+        request.add_header(SECRET_HEADER, secret_token)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def main(argv=None):
+    """Local harness: post synthetic updates to a running webhook server"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--user", type=int, default=1000)
+    parser.add_argument("--text", default="hello")
+    parser.add_argument("--reply-to", type=int, default=None)
+    parser.add_argument("--count", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    base_id = int(time.time())
+    for i in range(args.count):
+        update = synthetic_update(base_id + i, args.user, args.text, args.reply_to)
+        print(f"update {update['update_id']}: HTTP {post_update(args.url, update, args.secret)}")
+
+if __name__ == "__main__":
+    sys.exit(main())